@@ -13,6 +13,13 @@ class Nagare {
   constructor(error) {
     document.addEventListener("click", (evt) => this.processClick(evt), true);
     this.nagare_loaded_named_js = {};
+    this.nagare_html = {};
+    this.ws = null;
+    this.ws_requests = {};
+    this.ws_id = 0;
+    this.remote_calls = [];
+    this.page_id = Math.random().toString(36).slice(2);
+    this.policies = new Map();
 
     if (error) this.error = error;
   }
@@ -89,26 +96,82 @@ class Nagare {
     }
   }
 
+  createNode(node, html) {
+    var e = document.createElement(node.parentNode.tagName);
+    e.innerHTML = html;
+    var new_node = e.children[0];
+
+    new_node.querySelectorAll("script").forEach((js) => {
+      if (js.getAttribute("src")) {
+        var script = document.createElement("script");
+        [...js.attributes].forEach((attr) => script.setAttribute(attr.nodeName, attr.nodeValue));
+        js.parentNode.replaceChild(script, js);
+      } else {
+        js.parentNode.removeChild(js);
+        setTimeout(js.textContent, 0);
+      }
+    });
+
+    return new_node;
+  }
+
   replaceNode(id, html) {
     var node = document.getElementById(id);
 
     if (node && html) {
-      var e = document.createElement(node.parentNode.tagName);
-      e.innerHTML = html;
-      var new_node = e.children[0];
-
-      new_node.querySelectorAll("script").forEach((js) => {
-        if (js.getAttribute("src")) {
-          var script = document.createElement("script");
-          [...js.attributes].forEach((attr) => script.setAttribute(attr.nodeName, attr.nodeValue));
-          js.parentNode.replaceChild(script, js);
-        } else {
-          js.parentNode.removeChild(js);
-          setTimeout(js.textContent, 0);
-        }
-      });
+      this.nagare_html[id] = html;
+      node.parentNode.replaceChild(this.createNode(node, html), node);
+    }
+  }
 
+  crc32(s) {
+    if (!this.crc32_table) {
+      this.crc32_table = new Uint32Array(256);
+      for (var i = 0; i < 256; i++) {
+        var c = i;
+        for (var k = 0; k < 8; k++) c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+        this.crc32_table[i] = c;
+      }
+    }
+
+    var crc = 0xffffffff;
+    for (const b of new TextEncoder().encode(s)) crc = this.crc32_table[(crc ^ b) & 0xff] ^ (crc >>> 8);
+
+    return (crc ^ 0xffffffff) >>> 0;
+  }
+
+  morphNode(node, new_node) {
+    if (node.nodeType !== new_node.nodeType || node.nodeName !== new_node.nodeName) {
       node.parentNode.replaceChild(new_node, node);
+    } else if (node.nodeType !== Node.ELEMENT_NODE) {
+      if (node.nodeValue !== new_node.nodeValue) node.nodeValue = new_node.nodeValue;
+    } else if (!node.isEqualNode(new_node)) {
+      [...node.attributes].forEach((attr) => {
+        if (!new_node.hasAttribute(attr.name)) node.removeAttribute(attr.name);
+      });
+      [...new_node.attributes].forEach((attr) => {
+        if (node.getAttribute(attr.name) !== attr.value) node.setAttribute(attr.name, attr.value);
+      });
+
+      var children = [...node.childNodes];
+      var new_children = [...new_node.childNodes];
+
+      if (children.length !== new_children.length) node.replaceChildren(...new_children);
+      else children.forEach((child, i) => this.morphNode(child, new_children[i]));
+    }
+  }
+
+  patchNode(id, crc, prefix, suffix, middle) {
+    var node = document.getElementById(id);
+    var html = this.nagare_html[id];
+
+    if (!node || html === undefined || this.crc32(html) !== crc) {
+      // The HTML the patch is based on is unknown: the full HTML is requested again
+      this.stale = true;
+    } else {
+      html = html.slice(0, prefix) + middle + html.slice(html.length - suffix);
+      this.nagare_html[id] = html;
+      this.morphNode(node, this.createNode(node, html));
     }
   }
 
@@ -118,12 +181,69 @@ class Nagare {
     document.close();
   }
 
+  connect(url) {
+    var ws = new WebSocket(new URL(url, window.location.href).href.replace(/^http/, "ws"));
+
+    ws.onopen = () => (this.ws = ws);
+    ws.onclose = () => {
+      // Fallback to HTTP for the pending and next requests
+      this.ws = null;
+      var requests = this.ws_requests;
+      this.ws_requests = {};
+      for (var id in requests) requests[id][1](new Error("WebSocket closed"));
+    };
+    ws.onmessage = (event) => {
+      var message = JSON.parse(event.data);
+      var request = this.ws_requests[message.id];
+      delete this.ws_requests[message.id];
+
+      // Only the cookies without "HttpOnly" are received
+      (message.cookies || []).forEach((cookie) => (document.cookie = cookie));
+
+      var response = new Response(message.status === 204 ? null : message.body, {
+        status: message.status,
+        headers: message.headers,
+      });
+      if (request) request[0](response);
+    };
+  }
+
+  fetch(url, options) {
+    var body = options.body;
+    if (!this.ws || (body && [...body.values()].some((value) => value instanceof File))) return fetch(url, options);
+
+    var id = ++this.ws_id;
+    var message = {
+      id: id,
+      url: new URL(url, window.location.href).href,
+      method: options.method,
+      accept: options.headers.Accept || "*/*",
+      headers: Object.fromEntries(Object.entries(options.headers).filter(([name]) => /^x-nagare-/i.test(name))),
+      body: body ? new URLSearchParams(body).toString() : "",
+    };
+
+    return new Promise((resolve, reject) => {
+      var signal = options.signal;
+      if (signal && signal.aborted) return reject(signal.reason);
+
+      this.ws_requests[id] = [resolve, reject];
+      this.ws.send(JSON.stringify(message));
+
+      // The response of an aborted request is ignored
+      if (signal)
+        signal.addEventListener("abort", () => {
+          delete this.ws_requests[id];
+          reject(signal.reason);
+        });
+    });
+  }
+
   sendRequest(url, options) {
     options.cache = "no-cache";
-    options.headers = { "X-REQUESTED-WITH": "XMLHttpRequest" };
+    options.headers = Object.assign({ "X-REQUESTED-WITH": "XMLHttpRequest" }, options.headers);
     options.credentials = "same-origin";
 
-    return fetch(url, options)
+    return this.fetch(url, options)
       .catch(function () {
         throw new Error("Network error");
       })
@@ -146,45 +266,152 @@ class Nagare {
       );
   }
 
-  callRemote(url) {
-    return (...params) => this.sendRequest(
-            url + '&_params=' + encodeURIComponent(JSON.stringify(params)),
-            { method: "GET" }
-        ).then(
-            (response) => response.json()
+  callRemote(url, policy) {
+    if (policy)
+      return (...params) =>
+        this.sendWithPolicy(url + "&_params=" + encodeURIComponent(JSON.stringify(params)), policy, url, (response) =>
+          this.remoteResult(response),
         );
+
+    // The calls made in the same tick are sent together
+    return (...params) =>
+      new Promise((resolve, reject) => {
+        if (!this.remote_calls.length) queueMicrotask(() => this.sendRemoteCalls());
+        this.remote_calls.push([url, params, resolve, reject]);
+      });
+  }
+
+  remoteResult(response) {
+    // No body when the remote function returned NO_CHANGE
+    return response.status === 204 ? undefined : response.json();
+  }
+
+  sendRemoteCalls() {
+    var batches = {};
+
+    this.remote_calls.forEach((call, i) => {
+      var url = new URL(call[0], window.location.href);
+      var action = [...url.searchParams.keys()].find((name) => /^(_action|_-)[0-9A-F]/.test(name));
+      if (action) url.searchParams.delete(action);
+
+      // A call without action id can't be batched and is sent alone
+      var base = action ? url.href : i;
+      if (!batches[base]) batches[base] = [];
+      batches[base].push([action, call]);
+    });
+    this.remote_calls = [];
+
+    for (const [base, calls] of Object.entries(batches)) {
+      var request;
+
+      if (calls.length === 1) {
+        var [url, params] = calls[0][1];
+        request = this.sendRequest(url + "&_params=" + encodeURIComponent(JSON.stringify(params)), { method: "GET" })
+          .then((response) => this.remoteResult(response))
+          .then((r) => [r]);
+      } else {
+        var data = new FormData();
+        data.append("_batch", JSON.stringify(calls.map(([action, call]) => [action, call[1]])));
+        request = this.sendRequest(base, { method: "POST", body: data }).then((response) => response.json());
+      }
+
+      request.then(
+        (results) => calls.forEach(([action, call], i) => call[2](results[i])),
+        (e) => calls.forEach(([action, call]) => call[3](e)),
+      );
+    }
   }
 
-  delay(url) {
+  delay(url, policy) {
     return (t, ...params) =>
-      new Promise((resolve) => setTimeout(resolve, t, params)).then((args) => this.callRemote(url)(...args));
+      new Promise((resolve) => setTimeout(resolve, t, params)).then((args) => this.callRemote(url, policy)(...args));
   }
 
-  repeat(url) {
+  repeat(url, options) {
+    options = Object.assign({ backoff: 2, min_backoff: 1000, max_interval: 60000, pause_hidden: true }, options);
+    var fetchOptions = {
+      method: "GET",
+      cache: "no-cache",
+      credentials: "same-origin",
+      headers: { "X-REQUESTED-WITH": "XMLHttpRequest" },
+    };
+
     class _repeat {
       constructor(t, url, args) {
-        var interval = setInterval(
-          function () {
-            var p = nagare
-              .callRemote(url)(...args)
-              .catch(function (e) {
-                clearInterval(interval);
-                throw e;
-              });
-
-            if (this.then) p.then(this.then);
-            if (this.catch) p.catch(this.catch);
-          }.bind(this),
-          t,
-        );
+        this.interval = this.delay = t;
+        this.url = url + "&_params=" + encodeURIComponent(JSON.stringify(args));
+        this.schedule();
+      }
+
+      schedule() {
+        setTimeout(() => this.tick(), this.delay);
+      }
+
+      tick() {
+        if (options.pause_hidden && document.hidden) {
+          // Paused until the page is visible again
+          document.addEventListener("visibilitychange", () => this.tick(), { once: true });
+          return;
+        }
+
+        // Not sent by sendRequest(), which displays the errors: they are retried after a backoff
+        var send = (url, policyOptions) =>
+          nagare.fetch(
+            url,
+            Object.assign({}, fetchOptions, policyOptions, {
+              headers: Object.assign({}, fetchOptions.headers, policyOptions.headers),
+            }),
+          );
+
+        // Same policy state as the direct calls of the remote function
+        var request = options.policy
+          ? nagare.sendWithPolicy(this.url, options.policy, url, (response) => response, {}, send)
+          : send(this.url, {});
+
+        request
+          .then((response) => {
+            if (!response) return; // Stale response of an aborted request
+
+            var interval = response.headers.get("X-Nagare-Interval");
+            if (interval) this.interval = parseInt(interval);
+
+            var retry = this.retryAfter(response.headers.get("Retry-After"));
+
+            if (!response.ok) {
+              this.delay = retry !== null ? retry : this.backoff();
+              if (this.onCatch) this.onCatch(new Error("Server error " + response.status));
+              return;
+            }
+
+            this.delay = retry !== null ? retry : response.status === 204 ? this.backoff() : this.interval;
+            if (response.status !== 204) return response.json().then((r) => this.onThen && this.onThen(r));
+          })
+          .catch((e) => {
+            this.delay = this.backoff();
+            if (this.onCatch) this.onCatch(e);
+          })
+          .finally(() => this.schedule());
+      }
+
+      backoff() {
+        // Never a tight loop of retries, even after an interval of 0
+        return Math.min(Math.max(this.delay * options.backoff, options.min_backoff), options.max_interval);
+      }
+
+      retryAfter(retry) {
+        // "Retry-After" is a number of seconds or an HTTP date
+        if (!retry) return null;
+
+        var delay = /^\s*\d+\s*$/.test(retry) ? parseInt(retry) * 1000 : Date.parse(retry) - Date.now();
+        return isNaN(delay) || delay < 0 ? null : delay;
       }
 
       then(f) {
-        this.then = f;
+        this.onThen = f;
         return this;
       }
       catch(f) {
-        this.catch = f;
+        this.onCatch = f;
         return this;
       }
     }
@@ -192,29 +419,154 @@ class Nagare {
     return (t, ...params) => new _repeat(t, url, params);
   }
 
+  listen(url) {
+    this.push = new EventSource(url);
+    this.push.onmessage = (event) => (0, eval)(event.data);
+
+    return this.push;
+  }
+
+  onPush(event, f) {
+    this.push.addEventListener(event, (e) => f(JSON.parse(e.data)));
+  }
+
   getField(field) {
     return encodeURIComponent(field.type === "checkbox" && !field.checked ? "" : field.value);
   }
 
+  processParts(data) {
+    // Parts: "<command> <payload length> <args>\n<payload>"
+    var bytes = new Uint8Array(data);
+    var decoder = new TextDecoder();
+
+    for (var i = 0; i < bytes.length; ) {
+      var eol = bytes.indexOf(10, i);
+      var [command, length, ...args] = decoder.decode(bytes.subarray(i, eol)).split(" ");
+      i = eol + 1 + parseInt(length);
+      var payload = decoder.decode(bytes.subarray(eol + 1, i));
+
+      switch (command) {
+        case "replaceNode":
+          this.replaceNode(args[0], payload);
+          break;
+
+        case "patchNode":
+          this.patchNode(args[0], parseInt(args[1]), parseInt(args[2]), parseInt(args[3]), payload);
+          break;
+
+        case "loadAll":
+          this.loadAll(...JSON.parse(payload));
+          break;
+      }
+    }
+  }
+
+  evalResponse(response, refresh) {
+    var parts = (response.headers.get("content-type") || "").startsWith("application/x-nagare-parts");
+
+    return (parts ? response.arrayBuffer() : response.text()).then((data) => {
+      this.stale = false;
+      if (parts) this.processParts(data);
+      else (0, eval)(data);
+
+      // A patch was received for an unknown HTML: only the rendering is done again, not the actions
+      if (this.stale && refresh) return refresh();
+    });
+  }
+
+  refresh(url, options) {
+    return () => this.sendAndEval(url, Object.assign({}, options, { headers: { "X-Nagare-Refresh": "1" } }));
+  }
+
   sendAndEval(url, options) {
+    var refresh = options.headers && options.headers["X-Nagare-Refresh"] ? null : this.refresh(url, options);
+    options.headers = Object.assign({ Accept: "application/x-nagare-parts, text/plain" }, options.headers);
+
     return this.sendRequest(url, options)
       .catch(Promise.reject)
-      .then((response) => response.text())
-      .then(eval)
+      .then((response) => this.evalResponse(response, refresh))
       .catch((x) => undefined);
   }
 
-  getAndEval(url) {
-    this.sendAndEval(url, { method: "GET" });
+  sendWithPolicy(url, policy, key, process, fetchOptions, send) {
+    // Requests of an element with debouncing, coalescing and cancellation
+    var state = this.policies.get(key);
+    if (!state) {
+      state = { id: this.policies.size, seq: 0, timer: null, debounced: null, controller: null, next: null };
+      this.policies.set(key, state);
+    }
+
+    return new Promise((resolve, reject) => {
+      // The promise of a request replaced before being sent is rejected
+      var drop = () => reject(new DOMException("Request superseded", "AbortError"));
+
+      var send = () => {
+        if (policy.coalesce && state.controller) {
+          if (state.next) state.next[1]();
+          state.next = [send, drop]; // Sent when the request in flight is done
+          return;
+        }
+        if (policy.abort && state.controller) state.controller.abort();
+
+        var controller = (state.controller = new AbortController());
+        var seq = ++state.seq;
+        var options = Object.assign({ method: "GET" }, fetchOptions, {
+          signal: controller.signal,
+          headers: { Accept: "application/x-nagare-parts, text/plain" },
+        });
+        // The older requests of the element, still waiting on the server, are aborted: the server can skip them
+        if (policy.abort) options.headers["X-Nagare-Sequence"] = this.page_id + "-" + state.id + ":" + seq;
+
+        (send ? send(url, options) : this.sendRequest(url, options))
+          .then((response) => (seq === state.seq ? process(response) : undefined)) // Stale responses are ignored
+          .then(resolve, reject)
+          .finally(() => {
+            if (state.controller === controller) state.controller = null;
+            var next = state.next;
+            state.next = null;
+            if (next) next[0]();
+          });
+      };
+
+      if (policy.debounce) {
+        clearTimeout(state.timer);
+        if (state.debounced) state.debounced();
+        state.debounced = drop;
+        state.timer = setTimeout(() => {
+          state.debounced = null;
+          send();
+        }, policy.debounce);
+      } else send();
+    });
   }
 
-  postAndEval(form, action1, action2) {
+  getAndEval(url, policy, element) {
+    if (policy)
+      this.sendWithPolicy(url, policy, element || url, (response) =>
+        this.evalResponse(response, this.refresh(url, { method: "GET" })),
+      ).catch(
+        (x) => undefined,
+      );
+    else this.sendAndEval(url, { method: "GET" });
+  }
+
+  postAndEval(form, action1, action2, policy, element) {
     var data = new FormData(form);
 
     if (action1) data.append(action1[0], action1[1]);
     if (action2) data.append(action2[0], action2[1]);
 
-    return this.sendAndEval("?", { method: "POST", body: data });
+    var options = { method: "POST", body: data };
+    if (policy)
+      return this.sendWithPolicy(
+        "?",
+        policy,
+        element || form,
+        (response) => this.evalResponse(response, this.refresh("?", options)),
+        options,
+      ).catch((x) => undefined);
+
+    return this.sendAndEval("?", options);
   }
 
   processClick(event) {
@@ -233,15 +585,18 @@ class Nagare {
       }
     }
 
+    var policy = target.dataset["nagarePolicy"];
+    policy = policy && JSON.parse(policy);
+
     switch (target.dataset["nagare"][1]) {
       case "5":
         var action = target.getAttribute("href");
-        this.getAndEval(action);
+        this.getAndEval(action, policy, target);
         break;
 
       case "6":
         var action = target.getAttribute("name");
-        this.postAndEval(target.form, [action, ""]);
+        this.postAndEval(target.form, [action, ""], null, policy, target);
         break;
 
       case "7":
@@ -251,7 +606,7 @@ class Nagare {
         var x = Math.round(event.clientX - offset.left);
         var y = Math.round(event.clientY - offset.top);
 
-        this.postAndEval(target.form, [action + ".x", x], [action + ".y", y]);
+        this.postAndEval(target.form, [action + ".x", x], [action + ".y", y], policy, target);
         break;
     }
 
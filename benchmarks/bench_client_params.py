@@ -0,0 +1,75 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Rendering time of a list with and without client params.
+
+Usage: python benchmarks/bench_client_params.py [number of rows]
+"""
+
+import sys
+import timeit
+
+from nagare import component
+from nagare.services import callbacks
+from nagare.renderers import html
+
+
+def select(row=None, page=None):
+    pass
+
+
+def without_client_params(h, row):
+    return h.a(str(row)).action(select, row)
+
+
+def with_client_params(h, row):
+    return h.a(str(row)).action(select, row_c=row)
+
+
+def with_same_client_params(h, row):
+    return h.a(str(row)).action(select, page_c=1)
+
+
+def render(n, link):
+    h = html.Renderer(session_id='2KDgXn8T2cbM4tVw', state_id=10, component=component.Component())
+
+    with h.html, h.body, h.ul:
+        for row in range(n):
+            h << h.li(link(h, row))
+
+    return h.root
+
+
+def decode(n):
+    service = callbacks.callbacks_service
+    links = [service.encode_client_params({'row': row % 100}) for row in range(n)]
+
+    for link in links:
+        service.decode_client_params(link)
+
+
+def main(n=2000):
+    print(f'{"":30}{"not cached (ms)":>18}{"cached (ms)":>14}')
+
+    for name, f in (
+        ('without client params', lambda: render(n, without_client_params)),
+        ('with client params', lambda: render(n, with_client_params)),
+        ('with same client params', lambda: render(n, with_same_client_params)),
+        ('decoding (100 distinct)', lambda: decode(n)),
+    ):
+        durations = []
+        for cache_size in (0, 4096):
+            callbacks.CallbacksService('callbacks', None, client_params_cache=cache_size)
+            durations.append(min(timeit.repeat(f, number=1, repeat=5)) * 1000)
+
+        print(f'{name:30}{durations[0]:18.1f}{durations[1]:14.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,84 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Memory used by the components.
+
+The slotted ``Component`` is compared to ``DictComponent``, the previous layout
+(attributes into a ``__dict__``, actions tables always allocated).
+
+Usage: python benchmarks/bench_component_memory.py [number of components]
+"""
+
+import sys
+import pickle
+import tracemalloc
+
+from nagare import component, renderable
+
+
+class DictComponent(renderable.Renderable):
+    """Layout of the components before the slots."""
+
+    def __init__(self, o):
+        self.o = o
+        self.view = self.url = self._cont = self._on_answer = None
+        self._actions = {}
+        self._new_actions = {}
+
+    def register_action(self, action, with_request, render, args, kw):
+        action_id = len(self._new_actions)
+        self._new_actions[action_id] = (action, with_request, render, args, kw)
+
+        return action_id
+
+    def serialize_actions(self, clear_actions):
+        self._actions, self._new_actions = self._new_actions, {}
+        return self._actions
+
+
+def allocated(f, n):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = f(n)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    return objects, (after - before) / n
+
+
+def leaves(cls, n):
+    o = component.Empty()
+    return [cls(o) for _ in range(n)]
+
+
+def with_actions(cls, n):
+    comps = leaves(cls, n)
+    for comp in comps:
+        comp.register_action(component.Empty, False, None, (), {})
+        comp.serialize_actions(False)
+
+    return comps
+
+
+def main(n=10000):
+    print('Component instances have a __dict__:', hasattr(component.Component(), '__dict__'))
+    print(f'{"":30}{"bytes / component":>20}{"pickled bytes":>16}')
+
+    for name, f in (('leaf', leaves), ('with 1 action', with_actions)):
+        for cls, layout in ((DictComponent, 'before'), (component.Component, 'slots')):
+            comps, size = allocated(lambda n: f(cls, n), n)
+            pickled_size = len(pickle.dumps(comps, pickle.HIGHEST_PROTOCOL)) / n
+
+            print(f'{name + " (" + layout + ")":30}{size:20.1f}{pickled_size:16.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
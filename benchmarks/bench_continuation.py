@@ -0,0 +1,73 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Continuations micro-benchmarks.
+
+  - suspend / resume cost as a function of the frames depth
+  - restore engines compared on deep ``Component.call()`` chains
+
+Usage: python benchmarks/bench_continuation.py [number of iterations]
+"""
+
+import sys
+import timeit
+
+from nagare import component, continuation
+
+
+def chain(depth):
+    if depth:
+        return chain(depth - 1) + 1
+
+    return continuation.Continuation().suspend()
+
+
+def call_chain(comp, depth):
+    if depth:
+        return call_chain(comp, depth - 1) + 1
+
+    return comp.call(component.Empty())
+
+
+def call_and_answer(comp, depth):
+    component.call_wrapper(call_chain, comp, depth)
+    component.answer_wrapper(comp, 42)
+
+
+def main(number=1000):
+    engines = [('settrace', False)] + ([('monitoring', True)] if continuation.MONITORING else [])
+
+    print('depth       suspend' + ''.join(f'{"resume " + name:>20}' for name, _ in engines) + '   (usec)')
+    for depth in (1, 10, 50, 100, 200):
+        timings = [min(timeit.repeat(lambda: continuation.delimit(chain, depth), number=number, repeat=3))]
+
+        cont = continuation.delimit(chain, depth)
+        for _, use_monitoring in engines:
+            continuation.Continuation.use_monitoring = use_monitoring
+            timings.append(min(timeit.repeat(lambda: cont.resume(0), number=number, repeat=3)))
+
+        suspend, *resumes = (t / number * 1e6 for t in timings)
+        print(f'{depth:5}  {suspend:12.1f}' + ''.join(f'{t:20.1f}' for t in resumes))
+
+    print()
+    print('depth  ' + ''.join(f'{name:>14}' for name, _ in engines) + '   (usec / call + answer)')
+    for depth in (1, 10, 50, 100, 200):
+        timings = []
+
+        for _, use_monitoring in engines:
+            continuation.Continuation.use_monitoring = use_monitoring
+            comp = component.Component(component.Empty())
+
+            timings.append(min(timeit.repeat(lambda: call_and_answer(comp, depth), number=number, repeat=3)))
+
+        print(f'{depth:5}  ' + ''.join(f'{t / number * 1e6:14.1f}' for t in timings))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
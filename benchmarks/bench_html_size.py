@@ -0,0 +1,83 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Size of a data grid page and parsing time of its callback identifiers.
+
+The page is also converted to the previous format of the identifiers
+('_action<type on 2 hex chars><key on at least 8 digits>' and '_c=<5 digits>')
+to compare the sizes.
+
+Usage: python benchmarks/bench_html_size.py [number of rows]
+"""
+
+import re
+import sys
+import timeit
+import urllib.parse
+
+from nagare import component
+from nagare.services import callbacks
+from nagare.renderers import html
+
+ACTION = re.compile(r'(?<=[?&"|])_-([0-9A-F])([0-9a-zA-Z]+)')
+
+
+def select(row):
+    pass
+
+
+def set_value(row, value):
+    pass
+
+
+def render(n):
+    h = html.Renderer(session_id='2KDgXn8T2cbM4tVw', state_id=10, component=component.Component())
+
+    with h.html, h.body, h.form, h.table:
+        for row in range(n):
+            with h.tr:
+                h << h.td(h.a(str(row), href='/grid').action(select, row))
+                h << h.td(h.input(value=str(row)).action(set_value, row))
+                h << h.td(h.input(type='checkbox').action(set_value, row))
+
+    return h.root.tostring().decode('utf-8')
+
+
+def to_legacy(page):
+    def action(m):
+        flags, callback_id = int(m.group(1), 16), m.group(2)
+        action_type = ((flags & 8) << 1) | (flags & 7)
+
+        return '_action%02X%08d' % (action_type, callbacks.parse_action('_-0' + callback_id)[2])
+
+    return (
+        ACTION.sub(action, page).replace('_c=10', '_c=00010').replace('name="_c" value="10"', 'name="_c" value="00010"')
+    )
+
+
+def params(page):
+    names = re.findall(r'(?:href|name|value)="([^"]*)"', page)
+    names = [urllib.parse.urlsplit(name).query.split('&') if '?' in name else [name] for name in names]
+
+    return [(name.partition('=')[0], '') for query in names for name in query]
+
+
+def main(n=2000):
+    page = render(n)
+    print(f'{"":10}{"HTML bytes":>14}{"parsing (ms)":>16}')
+
+    for name, page in (('previous', to_legacy(page)), ('compact', page)):
+        received = params(page)
+        duration = min(timeit.repeat(lambda: callbacks.parse_actions(received), number=10, repeat=5)) * 100
+
+        print(f'{name:10}{len(page.encode("utf-8")):14}{duration:16.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -8,24 +8,153 @@
 # --
 
 import json
+import zlib
 import random
+import contextlib
 from functools import partial
 
 from nagare import component
 from nagare.services import callbacks
 from nagare.renderers import xml
 
+PARTS_CONTENT_TYPE = 'application/x-nagare-parts'
+REFRESH_HEADER = 'X-Nagare-Refresh'  # Only render the full HTML of the async roots, without actions
+NO_CHANGE = object()  # Result of a remote function, answered by a "204 No Content"
+
 
 def no_action(*args, **kw):
     return b''
 
 
+def accept_parts(request):
+    """Does the client accept the responses made of parts?
+
+    In:
+      - ``request`` -- the request object
+
+    Return:
+      - a boolean
+    """
+    return (request is not None) and (PARTS_CONTENT_TYPE in request.headers.get('Accept', ''))
+
+
+def accept_patches(request):
+    """Can the client receive patches of the async roots?
+
+    In:
+      - ``request`` -- the request object
+
+    Return:
+      - a boolean, ``False`` when the client asked for the full HTML again
+    """
+    return (request is None) or (REFRESH_HEADER not in request.headers)
+
+
+def generate_part(parts, command, *args, payload=''):
+    """Generate a command for the client.
+
+    A part is a ``<command> <payload length> <args>`` line followed by the raw UTF-8
+    payload. Else the command is a javascript call.
+
+    In:
+      - ``parts`` -- generate a part or a javascript call?
+      - ``command`` -- method of the ``nagare`` javascript object to call
+      - ``args`` -- ascii parameters of the command
+      - ``payload`` -- last parameter of the command
+
+    Return:
+      - the command
+    """
+    if not parts:
+        return b'nagare.%s(%s)' % (
+            command.encode('ascii'),
+            ', '.join(json.dumps(arg) for arg in args + (payload,)).encode('utf-8'),
+        )
+
+    payload = payload.encode('utf-8')
+    header = ' '.join([command, str(len(payload))] + [str(arg) for arg in args])
+
+    return header.encode('ascii') + b'\n' + payload
+
+
+def join_parts(parts, commands):
+    return (b'' if parts else b'; ').join(command for command in commands if command)
+
+
+def common_affixes(old, new):
+    """Lengths of the common prefix and suffix of two strings.
+
+    In:
+      - ``old``, ``new`` -- the strings
+
+    Return:
+      - the lengths of the prefix and of the suffix, in characters
+    """
+    # Binary searches, the slices comparisons being done in C
+    lo, hi = 0, min(len(old), len(new))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+
+    lo, hi = 0, min(len(old), len(new)) - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid :] == new[len(new) - mid :]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return prefix, lo
+
+
+def utf16_len(s):
+    """Length of a string in UTF-16 code units, as seen by javascript."""
+    return len(s.encode('utf-16-le')) // 2
+
+
+class Policy:
+    """Client-side policy of the asynchronous requests sent by an element."""
+
+    def __init__(self, debounce=0, coalesce=False, abort=False):
+        """Initialization.
+
+        In:
+          - ``debounce`` -- milliseconds without new event before sending a request
+          - ``coalesce`` -- while a request is in flight, only keep the latest new one
+          - ``abort`` -- abort the request in flight when a new one is sent
+        """
+        self.debounce = debounce
+        self.coalesce = coalesce
+        self.abort = abort
+
+    def to_json(self):
+        return json.dumps({'debounce': self.debounce, 'coalesce': self.coalesce, 'abort': self.abort})
+
+
+class Interval:
+    """Result of a remote function, changing the interval of its ``Repeat``."""
+
+    def __init__(self, value, interval):
+        """Initialization.
+
+        In:
+          - ``value`` -- the result
+          - ``interval`` -- the new interval, in milliseconds
+        """
+        self.value = value
+        self.interval = interval
+
+
 class Partial(partial):
     def __hash__(self):
         return hash((self.func, self.args, tuple(self.keywords.items())))
 
     def __eq__(self, partial):
-        return (self.func is partial.func) and (self.args == partial.args) and (self.keywords == partial.keywords)
+        return (self.func == partial.func) and (self.args == partial.args) and (self.keywords == partial.keywords)
 
 
 class Action:
@@ -42,7 +171,7 @@ class Action:
             client_params = ''
 
         action_id = component.register_action(action, with_request, render, args, kw)
-        action_id = '_action%02X%08d' % (action_type, action_id)
+        action_id = callbacks.encode_action(action_type, action_id)
 
         return action_id, client_params
 
@@ -58,6 +187,50 @@ class Action:
         tag.set_action(action_id, client_params)
 
 
+def call_with_row_key(action, *args, _key, **kw):
+    return action(*args, *_key, **kw)
+
+
+class Shared:
+    """Action shared by all the rows of a table or a list.
+
+    The action is registered once by component and only the row key is encoded,
+    as client params, into each link. So the actions table doesn't grow with the
+    number of rows. The action receives the row key after its own parameters.
+
+    Usage:
+
+      select = action.Shared(self.select)
+      for row in rows:
+          h << h.a(row.title).action(select, row.id)
+    """
+
+    def __init__(self, action, *args, update=None, **kw):
+        """Initialization.
+
+        In:
+          - ``action`` -- action to call
+          - ``args``, ``kw`` -- ``action`` parameters, shared by all the rows
+          - ``update`` -- ``Update`` object used in the asynchronous renderers (its action is ignored)
+        """
+        self.callback = Partial(call_with_row_key, action)
+        self.args = args
+        self.kw = kw
+        self.update = update
+
+    def register(self, renderer, component, tag, action_type, with_request, args, kw):
+        """Register the shared action on a tag.
+
+        In:
+          - ``args``, ``kw`` -- the row key, JSON serializable
+        """
+        kw = {(k if k.endswith('_c') else k + '_c'): v for k, v in kw.items()}
+        kw = dict(self.kw, _key_c=args, **kw)
+
+        action = self.update or renderer.default_action()
+        action.register(renderer, component, tag, action_type, with_request, self.args, kw, self.callback)
+
+
 class Update(Action):
     """Asynchronous updater object.
 
@@ -66,8 +239,9 @@ class Update(Action):
     """
 
     JS_CALL = 'nagare.getAndEval'
+    policy = None
 
-    def __init__(self, action=no_action, render='', component_to_update=None):
+    def __init__(self, action=no_action, render='', component_to_update=None, policy=None):
         """Initialisation.
 
         In:
@@ -91,9 +265,12 @@ class Update(Action):
 
           - ``permissions`` -- permissions needed to execute the action
           - ``subject`` -- subject to test the permissions on
+
+          - ``policy`` -- ``Policy`` of the requests (debouncing, coalescing, cancellation)
         """
         super().__init__(action)
         self._render = render
+        self.policy = policy
 
         if isinstance(component_to_update, xml.Tag):
             self.component_to_update = component_to_update.get('id') or (
@@ -137,45 +314,122 @@ class Update(Action):
         )
 
     @staticmethod
-    def generate_response_body(render, view, component_to_update, params, renderer):
+    def render_body(render, view, component_to_update, params, renderer):
+        """Render the view to update.
+
+        Return:
+          - the DOM id to update and the rendered tree (``None`` if nothing to update)
+        """
         html = render(renderer, *view, **dict(params))
         if html is None:
-            return b''
+            return None, None
 
         if callable(component_to_update):
             component_to_update = component_to_update()
 
         html.set('id', html.get('id', component_to_update))
 
-        return b"nagare.replaceNode('%s', %s)" % (
-            component_to_update.encode('ascii'),
-            json.dumps(html.tostring().decode('utf-8')).encode('utf-8'),
+        return component_to_update, html
+
+    @classmethod
+    def generate_response_body(cls, render, view, component_to_update, params, renderer):
+        component_to_update, html = cls.render_body(render, view, component_to_update, params, renderer)
+        if html is None:
+            return b''
+
+        return cls.serialize_body(
+            render, component_to_update, html, accept_parts(renderer.request), accept_patches(renderer.request)
         )
 
     @staticmethod
-    def generate_response_head(head, response):
-        response.content_type = 'text/plain'
+    def serialize_body(render, component_to_update, html, parts, patch=True):
+        """Generate the replacement or the patch of a DOM element.
+
+        In:
+          - ``render`` -- the rendering function used
+          - ``component_to_update`` -- the DOM id to update
+          - ``html`` -- the rendered tree
+          - ``parts`` -- generate a part or a javascript call?
+          - ``patch`` -- can a patch be sent? Else the client asked for the full HTML
+
+        Return:
+          - the command
+        """
+        html = html.tostring().decode('utf-8')
+
+        # The last HTML sent for an async root is kept to only send a patch the next time
+        comp = getattr(render, '__self__', None)
+        if not isinstance(comp, component.Component):
+            last_html = comp = None
+        else:
+            last_html = comp.last_html(component_to_update, html)
+
+        if patch and (last_html is not None):
+            prefix, suffix = common_affixes(last_html, html)
+            middle = html[prefix : len(html) - suffix]
+
+            if len(middle) < len(html) // 2:
+                return generate_part(
+                    parts,
+                    'patchNode',
+                    component_to_update,
+                    zlib.crc32(last_html.encode('utf-8')),
+                    utf16_len(html[:prefix]),
+                    utf16_len(html[len(html) - suffix :]),
+                    payload=middle,
+                )
+
+        return generate_part(parts, 'replaceNode', component_to_update, payload=html)
+
+    @staticmethod
+    def generate_response_head(head, response, parts=False):
+        """Generate the loading of the head assets.
+
+        In:
+          - ``head`` -- the head renderer
+          - ``response`` -- the response object
+          - ``parts`` -- generate a part or a javascript call?
 
-        return head.render_async().encode(response.charset)
+        Return:
+          - the command
+        """
+        vary = response.vary or ()
+        if 'Accept' not in vary:
+            response.vary = vary + ('Accept',)
+
+        if not parts:
+            response.content_type = 'text/plain'
+            return head.render_async().encode(response.charset)
+
+        response.content_type = PARTS_CONTENT_TYPE
+        assets = head.assets()
+        return generate_part(True, 'loadAll', payload=json.dumps(assets)) if assets else b''
 
     @classmethod
     def generate_response(cls, render, view, component_to_update, params, renderer):
         if callable(component_to_update):
             component_to_update = component_to_update()
 
+        parts = accept_parts(renderer.request)
         body = cls.generate_response_body(render, view, component_to_update, params, renderer)
-        head = cls.generate_response_head(renderer.head, renderer.response)
+        head = cls.generate_response_head(renderer.head, renderer.response, parts)
 
-        return body + b'; ' + head
+        return join_parts(parts, (body, head))
 
     def url(self, renderer, with_input=False, **kw):
         return (renderer.link if with_input else renderer.a).action(self, **kw).get('href')
 
     def javascript(self, renderer, with_field=False, **kw):
-        return '{}("{}"{})'.format(
-            self.JS_CALL, self.url(renderer, with_field, **kw), ' + nagare.getField(this)' if with_field else ''
+        return '{}("{}"{}{})'.format(
+            self.JS_CALL,
+            self.url(renderer, with_field, **kw),
+            ' + nagare.getField(this)' if with_field else '',
+            self.javascript_options(),
         )
 
+    def javascript_options(self):
+        return (', %s, this' % self.policy.to_json()) if self.policy else ''
+
     js = javascript
 
     def render(self, renderer, *args, **kw):
@@ -183,6 +437,8 @@ class Update(Action):
 
     def register(self, renderer, component, tag, action_type, with_request, args, kw, action=None):
         tag.set_action_async()
+        if self.policy:
+            tag.set('data-nagare-policy', self.policy.to_json())
 
         return super().register(renderer, component, tag, action_type, with_request, args, kw, action)
 
@@ -228,30 +484,72 @@ class Updates(Update):
 
     @classmethod
     def generate_response(cls, renders, renderer):
-        body = b'; '.join(render(renderer) for render in renders)
-        head = cls.generate_response_head(renderer.head, renderer.response)
+        """Render all the updates together.
+
+        The identical updates are rendered once and the updates nested into
+        other updates are skipped.
+        """
+        rendered = []  # (DOM id, rendered tree, rendering function)
+
+        with contextlib.suppress(TypeError):  # Unhashable view parameters, the updates are not deduplicated
+            renders = dict.fromkeys(renders)
 
-        return body + b'; ' + head
+        for update in renders:
+            if not isinstance(update, Partial):
+                update(renderer)
+                continue
+
+            render, view, component_to_update, params = update.args
+            if callable(component_to_update):
+                component_to_update = component_to_update()
+
+            if any(cls.contains(html, component_to_update) for _, html, _ in rendered):
+                continue
+
+            component_to_update, html = cls.render_body(render, view, component_to_update, params, renderer)
+            if html is not None:
+                rendered = [r for r in rendered if not cls.contains(html, r[0])]
+                rendered.append((component_to_update, html, render))
+
+        parts = accept_parts(renderer.request)
+        patch = accept_patches(renderer.request)
+        body = [cls.serialize_body(render, id_, html, parts, patch) for id_, html, render in rendered]
+        head = cls.generate_response_head(renderer.head, renderer.response, parts)
+
+        return join_parts(parts, body + [head])
+
+    @staticmethod
+    def contains(html, id_):
+        return (html.get('id') == id_) or bool(html.xpath('.//*[@id=$id]', id=id_))
 
 
 class Remote(Update, xml.Renderable):
     JS_CALL = 'nagare.callRemote'
+    batch = True  # Can be called into a batch of remote calls
 
-    def __init__(self, action, *args, with_request=False, **kw):
-        super().__init__(no_action, action, ' ')
+    def __init__(self, action, *args, with_request=False, policy=None, **kw):
+        super().__init__(no_action, action, ' ', policy)
 
         self.with_request = with_request
         self.args = args
         self.kw = kw
 
-    def generate_response(self, render, view, component_to_update, params, renderer):
+    def generate_response(self, render, view, component_to_update, params, renderer, batch_params=None):
+        """Call the remote function.
+
+        In:
+          - ``batch_params`` -- parameters of the call into a batch, else read from the ``_params`` parameter
+
+        Return:
+          - the JSON result or, into a batch, the result
+        """
         request = renderer.request
         response = renderer.response
 
         if self.with_request:
             render = Partial(render, request, response)
 
-        params = json.loads(request.params.get('_params', '[]'))
+        params = json.loads(request.params.get('_params', '[]')) if batch_params is None else batch_params
 
         try:
             r = callbacks.callbacks_service.execute_callback(
@@ -260,6 +558,17 @@ class Remote(Update, xml.Renderable):
         except component.CallAnswered:
             r = None
 
+        if isinstance(r, Interval):
+            response.headers['X-Nagare-Interval'] = str(r.interval)
+            r = r.value
+
+        if batch_params is not None:
+            return None if r is NO_CHANGE else r
+
+        if r is NO_CHANGE:
+            response.status_int = 204
+            return ''
+
         response.content_type = 'application/json'
         return json.dumps(r)
 
@@ -281,4 +590,45 @@ class Delay(Remote):
 
 
 class Repeat(Delay):
+    """Call a remote function periodically.
+
+    The polling is paused while the page is hidden and backs off exponentially on
+    errors or when the remote function returns ``NO_CHANGE``. The server can change
+    the interval with a ``Retry-After`` header or an ``Interval`` result.
+    """
+
     JS_CALL = 'nagare.repeat'
+    backoff = 2
+    min_backoff = 1000
+    max_interval = 60000
+    pause_hidden = True
+
+    def __init__(self, action, *args, backoff=2, min_backoff=1000, max_interval=60000, pause_hidden=True, **kw):
+        """Initialization.
+
+        In:
+          - ``action`` -- the remote function
+          - ``args``, ``kw`` -- the remote function parameters
+          - ``backoff`` -- multiplier of the interval after an error or no change
+          - ``min_backoff`` -- minimum interval after an error or no change, in milliseconds
+          - ``max_interval`` -- maximum interval, in milliseconds
+          - ``pause_hidden`` -- pause while the page is hidden?
+        """
+        super().__init__(action, *args, **kw)
+
+        self.backoff = backoff
+        self.min_backoff = min_backoff
+        self.max_interval = max_interval
+        self.pause_hidden = pause_hidden
+
+    def javascript_options(self):
+        options = {
+            'backoff': self.backoff,
+            'min_backoff': self.min_backoff,
+            'max_interval': self.max_interval,
+            'pause_hidden': self.pause_hidden,
+        }
+        if self.policy:
+            options['policy'] = vars(self.policy)
+
+        return ', ' + json.dumps(options)
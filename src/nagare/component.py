@@ -13,14 +13,52 @@ This model is inspired by the Seaside one. With the possibility to embed,
 replace and call a component. It's described in `ComponentModel`
 """
 
+import pickle
 import random
+import asyncio
+import hashlib
+import inspect
+import threading
 import contextlib
+import contextvars
+import concurrent.futures
 from functools import partial
+from itertools import islice
+from collections import OrderedDict
 
-from nagare import renderable, continuation, presentation
+from nagare import state, fragments, renderable, continuation, presentation
 from nagare.services import router
 
 _marker = object()
+ACTION_ID_BITS = 20  # Bits of the sequential part of the actions ids
+_async_action = contextvars.ContextVar('nagare.async_action', default=None)
+
+
+def _same_object(o1, o2):
+    # Bound methods are created on each access but are the same if bound to the same object
+    return (o1 is o2) or (inspect.ismethod(o1) and inspect.ismethod(o2) and (o1 == o2))
+
+
+def _same_action(action1, action2):
+    """Are two registrations bound to the very same objects?
+
+    In:
+      - ``action1``, ``action2`` -- ``(action, with_request, render, args, kw)`` entries
+
+    Return:
+      - ``True`` if all the parts are identical, not only equal
+    """
+    (f1, with_request1, render1, args1, kw1), (f2, with_request2, render2, args2, kw2) = action1, action2
+
+    return (
+        _same_object(f1, f2)
+        and (with_request1 == with_request2)
+        and _same_object(render1, render2)
+        and (len(args1) == len(args2))
+        and all(arg1 is arg2 for arg1, arg2 in zip(args1, args2))
+        and (kw1.keys() == kw2.keys())
+        and all(v is kw2[k] for k, v in kw1.items())
+    )
 
 
 class CallAnswered(Exception):
@@ -42,8 +80,19 @@ class Component(renderable.Renderable):
     """This class transforms any Python object into a component.
 
     A component has views, can be embedded, replaced, called and can answer a value.
+
+    The actions tables are only allocated when an action is registered.
     """
 
+    SERIALIZED_ATTRIBUTES = ('o', 'view', 'url', '_actions', '_cont', '_on_answer', '_uid', '_nb_actions', '_last_html')
+    TRANSIENT_ATTRIBUTES = ('_new_actions', '_action_ids', '_dirty', '_fragments')
+    __slots__ = SERIALIZED_ATTRIBUTES + TRANSIENT_ATTRIBUTES
+    if not hasattr(renderable.Renderable, '__weakref__'):
+        __slots__ += ('__weakref__',)
+
+    # Digest -> HTML sent for an async root, shared by all the sessions and bounded by the size of the HTML
+    sent_html = fragments.LRUCache(max_size=10 * 1024 * 1024)
+
     def __init__(self, o=None, view=presentation.ANON_VIEW, url=None):
         """Initialisation.
 
@@ -55,15 +104,45 @@ class Component(renderable.Renderable):
         """
         self._becomes(o, view, url)
 
-        self._actions = {}
-        self._new_actions = {}
+        self._actions = self._new_actions = self._action_ids = self._fragments = None
+        self._uid = self._nb_actions = self._last_html = None
 
         self._cont = None
         self._on_answer = None
+        self._dirty = True
+
+    def __getstate__(self):
+        """Only the not ``None`` attributes are serialized."""
+        state = dict(getattr(self, '__dict__', ()))
+        state.update((name, getattr(self, name)) for name in self.SERIALIZED_ATTRIBUTES)
+
+        return {name: value for name, value in state.items() if value is not None}
+
+    def __setstate__(self, state):
+        """Restore a component.
+
+        In:
+          - ``state`` -- dictionary of the attributes, from ``__getstate__()``
+            or from the ``__dict__`` of a component serialized before the slots
+        """
+        for name in self.SERIALIZED_ATTRIBUTES + self.TRANSIENT_ATTRIBUTES:
+            setattr(self, name, None)
+
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def register_action(self, action, with_request, render, args, kw):
         """Register an action for this component.
 
+        An action id is a random prefix, drawn once by component, followed by a sequence
+        number on ``ACTION_ID_BITS`` bits. The prefix keeps the ids unique once the actions
+        of all the components are merged, so the ids are about 11 characters long in base 62,
+        not the few characters of a sequence alone.
+
+        An id is the same for the same registration, i.e. equal action, render and parameters,
+        only if they are all hashable. The asynchronous actions, which render functions are
+        created again on each rendering, get new ids on each rendering.
+
         In:
           - ``view`` -- name of the view which registers this action (``None`` for the default view)
           - ``priority`` -- type and priority of the action
@@ -71,42 +150,146 @@ class Component(renderable.Renderable):
           - ``with_request`` -- will the request and response objects be passed to the action?
           - ``render`` -- the render function or method
           - ``actions`` -- the actions manager
+
+        Return:
+          - the action id, the same for the same registration as long as the action is kept
         """
-        k = (id(self), action, with_request, render, args, tuple(kw.items()))
+        if self._action_ids is None:
+            self._action_ids = {}
+
+            for action_id, (action_, with_request_, render_, args_, kw_) in (self._actions or {}).items():
+                with contextlib.suppress(TypeError):
+                    self._action_ids.setdefault((action_, with_request_, render_, args_, tuple(kw_.items())), action_id)
+
+        k = (action, with_request, render, args, tuple(kw.items()))
 
         try:
-            action_id = abs(hash(k))
+            action_id = self._action_ids.get(k)
         except TypeError:
-            action_id = random.randint(10000000, 99999999)
+            k = action_id = None
+
+        if action_id is None:
+            if self._uid is None:
+                # The sequential ids of each component are spread by a random prefix, see above
+                self._uid = random.getrandbits(64 - ACTION_ID_BITS) << ACTION_ID_BITS
+
+            self._nb_actions = ((self._nb_actions or 0) + 1) % (1 << ACTION_ID_BITS)
+            action_id = self._uid | self._nb_actions
+
+            if k is not None:
+                self._action_ids[k] = action_id
+
+        if self._new_actions is None:
+            self._new_actions = {}
 
-        self._new_actions[action_id] = (action, with_request, render, args, kw)
+        entry = self._new_actions[action_id] = (action, with_request, render, args, kw)
+        fragments.log_action(self, action_id, entry)
 
         return action_id
 
-    def serialize_actions(self, clear_actions):
+    def render(self, renderer, view=0, *args, **kw):
+        """Render the component.
+
+        The rendering of an unchanged component wrapping a ``fragments.Cached`` object is reused.
+
+        In:
+          - ``renderer`` -- the current renderer
+          - ``view`` -- the name of the view to use (``0`` for the view of the component)
+          - ``args``, ``kw`` -- the view parameters
+
+        Return:
+          - the rendered tree
+        """
+        if (self._last_html is not None) and not getattr(renderer, 'is_async', True):
+            # A new page is rendered, the browser forgot the HTML of the async root
+            self._last_html = None
+
+        return fragments.render(self, super().render, renderer, view, args, kw)
+
+    def last_html(self, id_, html):
+        """Remember the HTML sent when this component is an async root.
+
+        Only a digest of the HTML is kept by the component, not to grow the state
+        snapshots. The HTML is kept by the ``sent_html`` cache of the process, bounded
+        by the cumulated size of the HTML.
+
+        In:
+          - ``id_`` -- the DOM id of the async root
+          - ``html`` -- the HTML sent
+
+        Return:
+          - the previous HTML sent for this DOM id or ``None`` if unknown
+        """
+        digest = hashlib.blake2b(html.encode('utf-8'), digest_size=16).digest()
+
+        last_id, last_digest = self._last_html or (None, None)
+        self._last_html = (id_, digest)
+        self._dirty = True
+
+        last_html = self.sent_html.get(last_digest) if last_id == id_ else None
+        self.sent_html.set(digest, len(html), html, None)
+
+        return last_html and last_html[0]
+
+    def serialize_actions(self, clear_actions, max_actions=0, evicted=None):
         """Return the actions to serialize.
 
+        The actions are kept ordered by the last rendering of their view, the most
+        recent first.
+
         In:
           - ``clean_actions`` -- do we have to forget all the old actions?
+          - ``max_actions`` -- if not 0, maximum number of actions kept. Only the
+            old actions, of the views not rendered again, can be evicted
+          - ``evicted`` -- if not ``None``, dictionary receiving the evicted actions
 
         Return:
           - the actions of this component
         """
-        old, self._actions, self._new_actions = self._actions, self._new_actions, {}
-
-        if not clear_actions:
-            views = {action[0] for action in self._actions.values()}
+        old, new, self._new_actions = self._actions, self._new_actions, None
+
+        if new is None:
+            # Not rendered: the table is kept as-is, without any copy
+            if clear_actions:
+                self._actions = None
+        elif not old or clear_actions:
+            self._actions = new
+            self._action_ids = None
+        elif (new.keys() == old.keys()) and all(_same_action(v, old[k]) for k, v in new.items()):
+            # The same actions, bound to the same objects, were registered again:
+            # the old table and its ids map are kept
+            pass
+        else:
+            views = {action[0] for action in new.values()}
 
             # Keep only the old actions of a view if no new actions were registered
-            old = {k: v for k, v in old.items() if v[0] not in views}
-
-            self._actions.update(old)
+            old = [(k, v) for k, v in old.items() if (k not in new) and (v[0] not in views)]
+            if max_actions and (len(new) + len(old) > max_actions):
+                nb_kept = max(max_actions - len(new), 0)
+                if evicted is not None:
+                    evicted.update(islice(old, nb_kept, None))
+                old = old[:nb_kept]
+
+            new.update(old)
+            self._actions = new
+            self._action_ids = None
+
+        return self._actions or {}
+
+    def reduce(self, clean_callbacks, result, max_actions=0, evicted=None, changes=None, untracked=None):
+        actions = self._actions
+        result.callbacks.update(self.serialize_actions(clean_callbacks, max_actions, evicted))
+        result.components += 1
 
-        return self._actions
+        if changes is not None:
+            if self._dirty or (self._actions is not actions) or (state.is_tracked(self.o) and state.is_dirty(self.o)):
+                changes.append(self)
+            elif not state.is_tracked(self.o):
+                # Can have changed without being seen
+                (changes if untracked is None else untracked).append(self)
 
-    def reduce(self, clean_callbacks, result):
-        result.callbacks.update(self.serialize_actions(clean_callbacks))
-        result.components += 1
+            self._dirty = False
+            state.clean(self.o)
 
         return super().__reduce__()
 
@@ -124,6 +307,7 @@ class Component(renderable.Renderable):
         """
         o = self if type(o) is object else o
         self.o = o() if isinstance(o, Component) else o
+        self._dirty = True
 
         if view != presentation.CURRENT_VIEW:
             self.view = view
@@ -144,6 +328,9 @@ class Component(renderable.Renderable):
         """
         self._becomes(o, view, url or self.url)
         if not preserve_calls_chain:
+            if isinstance(self._cont, AsyncContinuation):
+                self._cont.cancel()
+
             self._cont = None
 
         return self
@@ -162,6 +349,10 @@ class Component(renderable.Renderable):
 
         # Return:
         #   - the answer of the called object
+        #   - into a coroutine action, an awaitable of the answer
+
+        if _async_action.get() is not None:
+            return self._call_async(o, view, url)
 
         previous = self.o, self.view, self.url, self._cont
 
@@ -170,9 +361,18 @@ class Component(renderable.Renderable):
         r = self._cont.suspend()
 
         self.o, self.view, self.url, self._cont = previous
+        self._dirty = True
 
         return r
 
+    async def _call_async(self, o, view, url):
+        cont = AsyncContinuation((self.o, self.view, self.url, self._cont))
+
+        self._becomes(o, view, url)
+        self._cont = cont
+
+        return await cont.suspend()
+
     def answer(self, r=_marker):
         """Answer to a call.
 
@@ -187,7 +387,13 @@ class Component(renderable.Renderable):
             return self._on_answer(r) if r is not _marker else self._on_answer()
         else:
             # I was called by on other component. Return my answer to it
-            self._cont.resume(r if r is not _marker else None)
+            cont = self._cont
+            if isinstance(cont, AsyncContinuation):
+                # The caller is restored from the current state, not by the coroutine
+                self.o, self.view, self.url, self._cont = cont.previous
+                self._dirty = True
+
+            cont.resume(r if r is not _marker else None)
             raise CallAnswered()
 
     def on_answer(self, f, *args, **kw):
@@ -198,6 +404,8 @@ class Component(renderable.Renderable):
           - ``args``, ``kw`` -- ``f`` parameters
         """
         self._on_answer = partial(f, *args, **kw) if args or kw else f
+        self._dirty = True
+
         return self
 
 
@@ -227,7 +435,11 @@ class Task:
 
     def run(self):
         self.content = Component(self).on_answer(self.raise_task_without_call)
-        call_wrapper(self._go, self.content)
+
+        if inspect.iscoroutinefunction(self.go):
+            async_wrapper(self._go_async(self.content))
+        else:
+            call_wrapper(self._go, self.content)
 
     def raise_task_without_call(self, _):
         raise TaskWithoutCall(self)
@@ -236,6 +448,10 @@ class Task:
         while True:
             comp.answer(self.go(comp))
 
+    async def _go_async(self, comp):
+        while True:
+            comp.answer(await self.go(comp))
+
     def go(self, comp):
         raise NotImplementedError()
 
@@ -248,6 +464,87 @@ def render_task(self, renderer, comp, view, *args, **kw):
     return self.content.on_answer(comp.answer if comp._on_answer else lambda r: None).render(renderer, *args, **kw)
 
 
+class GeneratorTask(Task):
+    """A ``Task`` which ``go()`` method is a generator yielding the objects to call.
+
+    ``r = yield o`` calls ``o`` and receives its answer, no ``Continuation`` is involved.
+    When ``go()`` returns, the task answers the returned value and ``go()`` is started again.
+    ``go()`` must yield at least one object.
+
+    .. warning::
+
+       The generator can't be serialized. Only the tasks declared ``pure``, i.e. which ``go()``
+       has no side effects between two ``yield``, can be pickled: the answers received are kept
+       and, once the session loaded, the generator is replayed from them. The replay costs all
+       the steps already done, on each request: keep these flows short. Pickling the other tasks
+       raises a ``pickle.PicklingError``.
+    """
+
+    pure = False
+    comp = None
+    generator = None
+
+    def run(self):
+        self.content = Component(self).on_answer(self.resume)
+        self.start()
+
+    def start(self):
+        self.answers = []
+        self.generator = self.go(self.content)
+
+        try:
+            o = next(self.generator)
+        except StopIteration:
+            # Answering and starting ``go()`` again would never end
+            raise ValueError("'go()' of %r yielded nothing" % self) from None
+
+        self.content.becomes(o)
+
+    def replay(self):
+        generator = self.go(self.content)
+
+        next(generator)
+        for answer in self.answers:
+            generator.send(answer)
+
+        return generator
+
+    def resume(self, r=None):
+        generator = self.generator or self.replay()
+        self.answers.append(r)
+
+        try:
+            o = generator.send(r)
+        except StopIteration as e:
+            self.answer(e.value)
+            self.start()
+        else:
+            self.generator = generator
+            self.content.becomes(o)
+
+    def answer(self, r):
+        if (self.comp is not None) and self.comp._on_answer:
+            self.comp.answer(r)
+
+    def __getstate__(self):
+        if not self.pure:
+            raise pickle.PicklingError('only the pure %s can be serialized' % type(self).__name__)
+
+        state = self.__dict__.copy()
+        state.pop('generator', None)
+
+        return state
+
+
+@presentation.render_for(GeneratorTask)
+def render_generator_task(self, renderer, comp, view, *args, **kw):
+    self.comp = comp
+    if not hasattr(self, 'content'):
+        self.run()
+
+    return self.content.render(renderer, *args, **kw)
+
+
 # -----------------------------------------------------------------------------------------------------
 
 
@@ -282,6 +579,179 @@ def call_wrapper(action, *args, **kw):
     return continuation.delimit(action, *args, **kw)
 
 
+# -----------------------------------------------------------------------------------------------------
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def event_loop():
+    """Return the event loop running the coroutine actions, started on first use in its own thread."""
+    global _event_loop
+
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name='nagare-async-actions', daemon=True).start()
+
+    return _event_loop
+
+
+class AsyncAction:
+    """Drive an awaitable action on the event loop until it returns or is suspended by a ``call()``."""
+
+    def __init__(self, loop, awaitable, timeout=None):
+        """Initialization.
+
+        In:
+          - ``loop`` -- the event loop
+          - ``awaitable`` -- the action
+          - ``timeout`` -- maximum time to wait for the action, in seconds. After it, the
+            action is cancelled (``None`` to wait until it returns or is suspended)
+        """
+        self.loop = loop
+        self.awaitable = awaitable
+        self.timeout = timeout
+        self.task = self.suspended = None
+        self.nested = []  # Actions resumed by this one, waited with it
+
+    def start(self):
+        _async_action.set(self)  # Copied into the context of the new task
+        self.task = asyncio.ensure_future(self.awaitable, loop=self.loop)
+
+    async def wait(self):
+        await asyncio.wait((self.task, self.suspended), return_when=asyncio.FIRST_COMPLETED)
+
+        while self.nested:
+            await self.nested.pop().wait()
+
+    async def step(self, f):
+        self.suspended = self.loop.create_future()
+        f()
+
+        await self.wait()
+
+        return self.task.result() if self.task.done() and not self.task.cancelled() else None
+
+    async def abort(self):
+        """Cancel the running actions, not the ones suspended by a call."""
+        actions = [self]
+        while actions:
+            action = actions.pop()
+            actions.extend(action.nested)
+
+            if not action.suspended.done():
+                action.task.cancel()
+                await asyncio.wait((action.task,))
+
+    def run(self, f):
+        """Run the action until it returns or is suspended.
+
+        The session state is only changed by the action while the request, holding the
+        session lock, waits for it. After the ``timeout``, the action is cancelled.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.loop:
+            # Resumed by an other coroutine: waited by the request of this one
+            self.suspended = self.loop.create_future()
+            f()
+            _async_action.get().nested.append(self)
+            return None
+
+        try:
+            return asyncio.run_coroutine_threadsafe(self.step(f), self.loop).result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            asyncio.run_coroutine_threadsafe(self.abort(), self.loop).result()
+            return None
+
+    def suspend(self):
+        if not self.suspended.done():
+            self.suspended.set_result(None)
+
+    def cancel(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+
+
+class AsyncContinuation:
+    """A coroutine suspended by ``await comp.call()``, stored in place of a ``Continuation``.
+
+    The suspended coroutines stay in the memory of the process, in ``AsyncContinuation.suspended``,
+    and go on with the objects they referenced when suspended. So they can only be used with a
+    sessions store keeping the objects in memory, without serialization: pickling a component
+    waiting for such a call raises a ``pickle.PicklingError``.
+
+    A coroutine is only resumed once. Answering again (i.e. double click) only restores the caller.
+    """
+
+    MAX_SUSPENDED = 10000
+    suspended = OrderedDict()  # Handle -> (action, future of the answer)
+    lock = threading.Lock()
+
+    def __init__(self, previous):
+        """Initialization.
+
+        In:
+          - ``previous`` -- the (object, view, url, continuation) of the caller
+        """
+        self.previous = previous
+        self.key = random.getrandbits(64)
+
+        action = _async_action.get()
+        self.register(self.key, action, action.loop.create_future())
+
+    def __reduce__(self):
+        raise pickle.PicklingError(
+            "a coroutine suspended by 'await comp.call()' can't be serialized, use a sessions store without pickling"
+        )
+
+    @classmethod
+    def register(cls, key, action, answer):
+        with cls.lock:
+            cls.suspended[key] = (action, answer)
+
+            if len(cls.suspended) > cls.MAX_SUSPENDED:
+                # The oldest coroutine, probably of an expired session, is abandoned
+                cls.suspended.popitem(last=False)[1][0].cancel()
+
+    def pop(self):
+        with self.lock:
+            return self.suspended.pop(self.key, (None, None))
+
+    async def suspend(self):
+        action, answer = self.suspended[self.key]
+        action.suspend()
+
+        return await answer
+
+    def resume(self, return_value=None):
+        action, answer = self.pop()
+
+        return action.run(partial(answer.set_result, return_value)) if action is not None else None
+
+    def cancel(self):
+        action, _ = self.pop()
+        if action is not None:
+            action.cancel()
+
+
+def async_wrapper(awaitable, timeout=None):
+    """Run an awaitable on the actions event loop and wait for its result or its suspension.
+
+    In:
+      - ``awaitable`` -- typically the coroutine returned by an ``async def`` action
+      - ``timeout`` -- maximum time to wait, in seconds, before cancelling the action
+
+    Return:
+      - the result of the awaitable or ``None`` if it was suspended by an ``await comp.call()`` or cancelled
+    """
+    action = AsyncAction(event_loop(), awaitable, timeout)
+    return action.run(action.start)
+
+
 def answer_wrapper(comp, *args):
     with contextlib.suppress(CallAnswered):
         comp.answer(*args)
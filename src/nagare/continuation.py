@@ -10,16 +10,176 @@
 """A ``Continuation()`` object captures a delimited execution context.
 
 See: https://en.wikipedia.org/wiki/Delimited_continuation
+
+Only the locals still used after the suspension point are captured. Set
+``Continuation.debug`` to log the number of bytes pruned from each frame.
+
+Two engines can restore a continuation:
+
+  - ``sys.settrace()`` -- available on all the Python versions
+  - ``sys.monitoring`` (PEP 669, Python >= 3.12) -- only the code objects of the
+    captured frames are instrumented, so the other calls run at full speed and
+    the profilers or coverage tracers are left untouched
 """
 
+import dis
 import sys
+import pickle
+import logging
+import weakref
 import warnings
+import threading
 from hashlib import sha256
 from functools import partial
 from traceback import walk_tb
+from collections import Counter
 
 warnings.filterwarnings('ignore', 'assigning None to ([0-9]+ )?unbound local', RuntimeWarning)
 
+MONITORING = hasattr(sys, 'monitoring')
+
+logger = logging.getLogger(__name__)
+
+NO_FALLTHROUGH = {
+    'RETURN_VALUE',
+    'RETURN_CONST',
+    'RAISE_VARARGS',
+    'RERAISE',
+    'JUMP_FORWARD',
+    'JUMP_BACKWARD',
+    'JUMP_ABSOLUTE',
+    'JUMP_BACKWARD_NO_INTERRUPT',
+}
+JUMPS = set(dis.hasjrel) | set(dis.hasjabs)
+
+
+def loaded_names(instruction):
+    """Names of the local variables read by an instruction."""
+    opname = instruction.opname
+    if not any(kind in opname for kind in ('FAST', 'DEREF', 'CLOSURE')) or opname.startswith('STORE_FAST_STORE'):
+        return ()
+
+    names = instruction.argval if isinstance(instruction.argval, tuple) else (instruction.argval,)
+
+    if opname == 'STORE_FAST_LOAD_FAST':
+        return names[1:]
+
+    return () if opname.startswith('STORE') else names
+
+
+def live_locals(code, lineno):
+    """Names of the locals that can be read once the execution is resumed at ``lineno``.
+
+    The instructions reachable from ``lineno`` are walked, following the jumps and
+    the exception handlers. The result is conservative: a variable read on a
+    reachable path is kept even if it's always reassigned before.
+
+    In:
+      - ``code`` -- code object of a captured frame
+      - ``lineno`` -- existing line where the execution will be resumed
+
+    Return:
+      - the set of the live locals or ``None`` if all the locals must be kept
+    """
+    if not code.co_flags & 0x01:  # Not CO_OPTIMIZED, i.e module or class body
+        return None
+
+    instructions = list(dis.get_instructions(code))
+    indexes = {instruction.offset: i for i, instruction in enumerate(instructions)}
+    handlers = getattr(dis.Bytecode(code), 'exception_entries', ())
+
+    todo = [indexes[offset] for offset, line in dis.findlinestarts(code) if line == lineno]
+    live = set(code.co_cellvars) | set(code.co_freevars)
+    reachable = set()
+
+    while todo:
+        i = todo.pop()
+        while (i < len(instructions)) and (i not in reachable):
+            reachable.add(i)
+            instruction = instructions[i]
+
+            live.update(loaded_names(instruction))
+            if instruction.opcode in JUMPS:
+                todo.append(indexes[instruction.argval])
+            todo.extend(indexes[e.target] for e in handlers if e.start <= instruction.offset < e.end)
+
+            if instruction.opname in NO_FALLTHROUGH:
+                break
+
+            i += 1
+
+    return frozenset(live)
+
+
+def pickled_size(o):
+    try:
+        return len(pickle.dumps(o, pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return sum(sys.getsizeof(v) for v in o.values())
+
+
+class CodeInfo:
+    """Precomputed data of a code object captured into a continuation."""
+
+    def __init__(self, code):
+        self._code = weakref.ref(code)  # The registry doesn't keep the code objects alive
+        self.hash = sha256(code.co_filename.encode('utf-8') + str(code.co_firstlineno).encode('utf-8')).digest()[:8]
+
+        self._lines = None
+        self._live_locals = {}
+
+    @property
+    def code(self):
+        return self._code()
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = frozenset(line for _, line in dis.findlinestarts(self.code) if line is not None)
+
+        return self._lines
+
+    def jump_target(self, lineno):
+        """Check the target of a ``frame.f_lineno = lineno`` jump.
+
+        Return:
+          - ``lineno`` or ``None`` if no instruction starts on this line
+        """
+        return lineno if lineno in self.lines else None
+
+    def live_locals(self, lineno):
+        lineno = self.jump_target(lineno)
+        if lineno is None:
+            return None
+
+        if lineno not in self._live_locals:
+            self._live_locals[lineno] = live_locals(self.code, lineno)
+
+        return self._live_locals[lineno]
+
+
+# ``id(code)`` -> ``CodeInfo``. The entries are removed when their code objects are collected
+_codes = {}
+# Frame hash -> ``CodeInfo``, filled each time a continuation is captured in this process
+_hashes = {}
+
+
+def forget_code(code_id, info):
+    if _codes.get(code_id) is info:
+        del _codes[code_id]
+
+    if _hashes.get(info.hash) is info:
+        del _hashes[info.hash]
+
+
+def code_info(code):
+    info = _codes.get(id(code))
+    if (info is None) or (info.code is not code):
+        info = _codes[id(code)] = CodeInfo(code)
+        weakref.finalize(code, forget_code, id(code), info)
+
+    return info
+
 
 class ContinuationException(Exception):
     pass
@@ -38,6 +198,10 @@ class ContinuationCodeBlockNotFound(ContinuationException):
 
 
 class Continuation:
+    use_monitoring = MONITORING
+    tracing = False
+    debug = False
+
     def __init__(self):
         self.populate(None, None, None, [])
 
@@ -45,55 +209,112 @@ class Continuation:
         self.f = f
         self.args = args
         self.kw = kw
-        self.frames = [(self.frame_hash(frame), lineno, dict(frame.f_locals)) for frame, lineno in frames]
+        self.frames = []
+
+        for i, (frame, lineno) in enumerate(frames, 1):
+            info = code_info(frame.f_code)
+            _hashes[info.hash] = info
+
+            # The execution of the last frame is resumed on the line after the suspension
+            self.frames.append(
+                (info.hash, lineno, self.capture_locals(info, lineno + (i == len(frames)), frame.f_locals))
+            )
+
+    def capture_locals(self, info, lineno, f_locals):
+        live = info.live_locals(lineno)
+        if live is None:
+            return dict(f_locals)
+
+        locals_ = {name: value for name, value in f_locals.items() if name in live}
+
+        if self.debug and (len(locals_) != len(f_locals)):
+            pruned = {name: value for name, value in f_locals.items() if name not in live}
+            logger.debug(
+                "%d bytes pruned from frame '%s' of '%s': %s",
+                pickled_size(pruned),
+                info.code.co_name,
+                info.code.co_filename,
+                ', '.join(pruned),
+            )
+
+        return locals_
 
     @staticmethod
     def frame_hash(frame):
-        code = frame.f_code
-        return sha256(code.co_filename.encode('utf-8') + str(code.co_firstlineno).encode('utf-8')).digest()[:8]
+        return code_info(frame.f_code).hash
 
     @staticmethod
     def _stop(frame, event, arg):
         return None
 
+    @staticmethod
+    def _unreachable_line(lineno, code):
+        return ContinuationUnreacheableLine(
+            f"Unreachable line {lineno} in function '{code.co_name}' of '{code.co_filename}'"
+        )
+
     @classmethod
     def _jump(cls, lineno, frame, event, arg):
         try:
             frame.f_lineno = lineno
         except ValueError:
-            raise ContinuationUnreacheableLine(
-                f"Unreachable line {lineno} in function '{frame.f_code.co_name}' of '{frame.f_code.co_filename}'"
-            )
+            raise cls._unreachable_line(lineno, frame.f_code)
 
         return cls._stop
 
     def _enter_function(self, frame, event, arg):
+        if self.current_frame == len(self.frames):
+            return None
+
         f_hash, lineno, locals_ = self.frames[self.current_frame]
-        if self.frame_hash(frame) != f_hash:
+        info = code_info(frame.f_code)
+        if info.hash != f_hash:
             return None
 
         self.current_frame += 1
         if self.current_frame == len(self.frames):
             lineno += 1
 
+        if info.jump_target(lineno) is None:
+            raise self._unreachable_line(lineno, info.code)
+
         frame.f_locals.update(locals_)
 
         return partial(self._jump, lineno)
 
-    def resume(self, return_value=None):
-        self.current_frame = 0
-        self.return_value = return_value
-
+    def _resume_with_settrace(self):
         sys.settrace(self._enter_function)
 
         try:
-            r = delimit(self.f, *self.args, **self.kw)
-            if not self.current_frame == len(self.frames):
-                raise ContinuationCodeBlockNotFound()
-            return r
+            return delimit(self.f, *self.args, **self.kw)
         finally:
             sys.settrace(None)
 
+    def resume(self, return_value=None):
+        self.current_frame = 0
+        self.return_value = return_value
+
+        infos = [_hashes.get(f_hash) for f_hash, _, _ in self.frames]
+
+        # Check the target lines before any code is re-executed
+        for i, (info, (_, lineno, _)) in enumerate(zip(infos, self.frames), 1):
+            lineno += i == len(self.frames)
+            if (info is not None) and (info.jump_target(lineno) is None):
+                raise self._unreachable_line(lineno, info.code)
+
+        if not self.use_monitoring or (None in infos):
+            # Captured in an other process or no ``sys.monitoring`` support
+            self.tracing = True
+            r = self._resume_with_settrace()
+        else:
+            self.tracing = False
+            r = _monitoring.resume(self, [info.code for info in infos])
+
+        if not self.current_frame == len(self.frames):
+            raise ContinuationCodeBlockNotFound()
+
+        return r
+
     __call__ = resume
 
     def _suspend(self):
@@ -101,13 +322,141 @@ class Continuation:
 
     def suspend(self):
         self._suspend()
-        sys.settrace(None)
+        if self.tracing:
+            sys.settrace(None)
 
         return self.return_value
 
     shift = suspend
 
 
+if MONITORING:
+    if sys.version_info < (3, 13):
+        import ctypes
+
+        def update_locals(frame, locals_):
+            frame.f_locals.update(locals_)
+            # Outside of a ``sys.settrace()`` hook, the locals snapshot must be written back explicitly
+            ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(frame), ctypes.c_int(0))
+
+    else:
+
+        def update_locals(frame, locals_):
+            frame.f_locals.update(locals_)  # PEP 667: ``f_locals`` is a write-through proxy
+
+    class _Monitoring(threading.local):
+        """Restore engine based on ``sys.monitoring``.
+
+        The events are global to the interpreter so the callbacks only act on the
+        continuation resumed by the current thread.
+        """
+
+        EVENTS = sys.monitoring.events
+        TOOL_NAME = 'nagare.continuation'
+
+        tool_id = None
+        lock = threading.Lock()
+        instrumented = Counter()  # Code object -> number of continuations being resumed
+
+        continuation = None
+        codes = ()
+        jump = None
+
+        @classmethod
+        def register(cls):
+            with cls.lock:
+                if cls.tool_id is None:
+                    cls.tool_id = False
+
+                    # The free ids first, the one reserved to the optimizers as a last resort
+                    for tool_id in (3, 4, sys.monitoring.OPTIMIZER_ID):
+                        if sys.monitoring.get_tool(tool_id) is None:
+                            sys.monitoring.use_tool_id(tool_id, cls.TOOL_NAME)
+                            sys.monitoring.register_callback(tool_id, cls.EVENTS.PY_START, cls.on_start)
+                            sys.monitoring.register_callback(tool_id, cls.EVENTS.LINE, cls.on_line)
+                            cls.tool_id = tool_id
+                            break
+
+            return cls.tool_id
+
+        @classmethod
+        def update(cls, codes, increment):
+            with cls.lock:
+                for code in codes:
+                    cls.instrumented[code] += increment
+                    if cls.instrumented[code] in (0, increment):
+                        events = (cls.EVENTS.PY_START | cls.EVENTS.LINE) if increment > 0 else 0
+                        sys.monitoring.set_local_events(cls.tool_id, code, events)
+
+                    if not cls.instrumented[code]:
+                        del cls.instrumented[code]
+
+        def resume(self, continuation, codes):
+            if not self.tool_id and (self.register() is False):
+                # All the free tool ids are already used (checked again on each call, as
+                # ``False`` would be read as the tool id 0 by ``sys.monitoring``)
+                continuation.tracing = True
+                return continuation._resume_with_settrace()
+
+            previous = self.continuation, self.codes, self.jump
+            self.continuation, self.codes, self.jump = continuation, codes, None
+            self.update(set(codes), 1)
+
+            try:
+                return delimit(continuation.f, *continuation.args, **continuation.kw)
+            finally:
+                self.stop()
+                self.continuation, self.codes, self.jump = previous
+
+        def stop(self):
+            if self.codes:
+                self.update(set(self.codes), -1)
+                self.codes = ()
+
+        @staticmethod
+        def on_start(code, instruction_offset):
+            self = _monitoring
+            continuation = self.continuation
+            if (continuation is None) or (self.jump is not None):
+                return
+
+            i = continuation.current_frame
+            if (i >= len(self.codes)) or (code is not self.codes[i]):
+                return
+
+            frame = sys._getframe(1)
+            _, lineno, locals_ = continuation.frames[i]
+
+            continuation.current_frame += 1
+            if continuation.current_frame == len(continuation.frames):
+                lineno += 1
+
+            update_locals(frame, locals_)
+
+            # ``f_lineno`` can't be changed on a ``PY_START`` event, wait for the first line
+            self.jump = (frame, lineno)
+
+        @staticmethod
+        def on_line(code, line_number):
+            self = _monitoring
+            if (self.jump is None) or (self.jump[0] is not sys._getframe(1)):
+                return
+
+            frame, lineno = self.jump
+            self.jump = None
+
+            if self.continuation.current_frame == len(self.codes):
+                # Last frame reached, nothing more to instrument
+                self.stop()
+
+            try:
+                frame.f_lineno = lineno
+            except ValueError:
+                raise Continuation._unreachable_line(lineno, code)
+
+    _monitoring = _Monitoring()
+
+
 def delimit(f, *args, **kw):
     try:
         return f(*args, **kw)
@@ -0,0 +1,418 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Caches of the rendered fragments.
+
+The rendering of a component is reused while the component, its object and
+all its nested components are unchanged. Only the components wrapping
+``Cached`` objects are cached, and only by the synchronous renderers. The
+changes are only reset by the ``track_changes`` option of the state service:
+without it, nothing is cached and a warning is issued.
+
+The fragments reference the components and the actions they were rendered
+with, so they are only kept in memory, with the components, and never
+serialized. The cache is reused across the requests when the sessions store
+keeps the objects graphs alive between them. With a store serializing the
+states, it is empty after each state load and only the renderings of a same
+component in a same request are reused.
+
+.. warning::
+    The changes are detected by ``state.Tracked``, which only sees the assignments
+    of attributes. After an in-place change of a ``Cached`` object (i.e. a
+    ``var.Var`` set, a list or a dict modified), call ``state.touch()`` or the
+    previous rendering is sent.
+
+The rendering of the views declared ``pure()`` are shared by all the sessions.
+"""
+
+import re
+import copy
+import warnings
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+
+from lxml import etree
+
+from nagare import state
+from nagare.renderers import xml
+
+HEAD_ATTRIBUTES = ('_named_css', '_css_url', '_named_javascript', '_javascript_url')
+STATE_ID = r'(?<=_c=)0*%d(?![0-9])'
+
+# Set by the state service. The components changes are only reset with its ``track_changes`` option
+changes_tracked = None
+
+# Components rendered and actions registered during the current rendering
+_log = contextvars.ContextVar('nagare.fragments_log', default=None)
+
+
+class Cached(state.Tracked):
+    """Mixin enabling the fragments cache for the components wrapping the object.
+
+    All the components rendered into the view of such a component must also wrap
+    ``Cached`` objects for the rendering to be cached.
+    """
+
+
+def log_action(component, action_id, action):
+    """Log an action registered during the rendering.
+
+    In:
+      - ``component`` -- the component registering the action
+      - ``action_id`` -- the action id
+      - ``action`` -- the action entry of the actions table
+    """
+    log = _log.get()
+    if log is not None:
+        log.append((component, action_id, action))
+
+
+def is_cacheable(output):
+    if isinstance(output, (list, tuple)):
+        return all(map(is_cacheable, output))
+
+    return isinstance(output, (str, xml.Tag))
+
+
+def head_sizes(renderer):
+    head = getattr(renderer, 'head', None)
+    return None if head is None else [len(getattr(head, attr, ())) for attr in HEAD_ATTRIBUTES]
+
+
+def new_head_entries(renderer, sizes):
+    """Return the head entries added since ``head_sizes()``.
+
+    In:
+      - ``renderer`` -- the renderer used
+      - ``sizes`` -- the sizes of the head renderer entries
+
+    Return:
+      - list of (attribute of the head renderer, items)
+    """
+    entries = []
+
+    if sizes:
+        for attr, size in zip(HEAD_ATTRIBUTES, sizes):
+            items = getattr(renderer.head, attr, {})
+            if len(items) > size:
+                entries.append((attr, list(items.items())[size:]))
+
+    return entries
+
+
+def replace_state_id(output, state_id, new_state_id):
+    """Replace the state id into the urls of a rendered tree.
+
+    In:
+      - ``output`` -- the rendered tree
+      - ``state_id`` -- the state id the tree was rendered with
+      - ``new_state_id`` -- the current state id
+
+    Return:
+      - the rendered tree
+    """
+    if isinstance(output, (list, tuple)):
+        return type(output)(replace_state_id(o, state_id, new_state_id) for o in output)
+
+    state_id_re = re.compile(STATE_ID % state_id)
+    new_state_id = str(new_state_id)
+
+    if isinstance(output, str):
+        return state_id_re.sub(new_state_id, output)
+
+    for element in output.iter():
+        for name, value in element.attrib.items():
+            if '_c=' in value:
+                element.set(name, state_id_re.sub(new_state_id, value))
+
+        if element.get('name') == '_c':
+            element.set('value', new_state_id)
+
+    return output
+
+
+def add_head_entries(renderer, entries):
+    for attr, items in entries:
+        head = getattr(renderer.head, attr)
+        for k, v in items:
+            head.setdefault(k, v)
+
+
+class Fragment:
+    """A rendered tree with the components and actions it depends on."""
+
+    def __init__(self, output, log, head, state_id):
+        """Initialization.
+
+        In:
+          - ``output`` -- the rendered tree
+          - ``log`` -- the components rendered and actions registered
+          - ``head`` -- the new head entries, list of (attribute of the head renderer, items)
+          - ``state_id`` -- the state id the tree was rendered with
+        """
+        self.output = copy.deepcopy(output)
+        self.state_id = state_id
+        self.log = log
+        self.components = [component for component, action_id, _ in log if action_id is None]
+        self.head = head
+
+    @classmethod
+    def record(cls, output, log, renderer, sizes):
+        """Create a fragment if the rendered tree can be cached.
+
+        In:
+          - ``output`` -- the rendered tree
+          - ``log`` -- the components rendered and actions registered
+          - ``renderer`` -- the renderer used
+          - ``sizes`` -- the sizes of the head renderer entries before the rendering
+
+        Return:
+          - the fragment or ``None``
+        """
+        if not is_cacheable(output) or not all(isinstance(comp.o, Cached) for comp, id_, _ in log if id_ is None):
+            return None
+
+        return cls(output, log, new_head_entries(renderer, sizes), getattr(renderer, 'state_id', None))
+
+    def is_valid(self):
+        return not any(comp._dirty or state.is_dirty(comp.o) for comp in self.components)
+
+    def replay(self, renderer):
+        """Reuse the fragment.
+
+        The actions are registered again, the head entries added and the state id
+        updated into the urls.
+
+        In:
+          - ``renderer`` -- the current renderer
+
+        Return:
+          - a copy of the rendered tree
+        """
+        log = _log.get()
+        if log is not None:
+            log.extend(self.log)
+
+        for component, action_id, action in self.log:
+            if action_id is not None:
+                if component._new_actions is None:
+                    component._new_actions = {}
+
+                component._new_actions[action_id] = action
+
+        add_head_entries(renderer, self.head)
+
+        output = copy.deepcopy(self.output)
+
+        state_id = getattr(renderer, 'state_id', None)
+        if (self.state_id is not None) and (state_id is not None) and (state_id != self.state_id):
+            output = replace_state_id(output, self.state_id, state_id)
+
+        return output
+
+
+def render(component, render, renderer, view, args, kw):
+    """Render a component, reusing its last fragment if unchanged.
+
+    In:
+      - ``component`` -- the component
+      - ``render`` -- the rendering function
+      - ``renderer`` -- the current renderer
+      - ``view``, ``args``, ``kw`` -- the view to render and its parameters
+
+    Return:
+      - the rendered tree
+    """
+    log = _log.get()
+
+    cached = isinstance(component.o, Cached)
+    if cached and (changes_tracked is False):
+        warnings.warn('The fragments cache needs the `track_changes` option of the state service', RuntimeWarning)
+        cached = False
+
+    if getattr(renderer, 'is_async', True) or not cached:
+        if log is not None:
+            log.append((component, None, None))
+
+        return render(renderer, view, *args, **kw)
+
+    request = getattr(renderer, 'request', None)
+    context = (
+        type(renderer),
+        getattr(renderer, 'session_id', None),
+        getattr(renderer, 'url', None),
+        getattr(request, 'is_xhr', None),
+    )
+
+    try:
+        key = (view, args, tuple(kw.items()))
+        context_, fragment = (component._fragments or {}).get(key, (None, None))
+    except TypeError:
+        key = fragment = None
+
+    if (fragment is not None) and (context_ == context) and fragment.is_valid():
+        return fragment.replay(renderer)
+
+    token = None
+    if log is None:
+        log = []
+        token = _log.set(log)
+
+    start = len(log)
+    log.append((component, None, None))
+    sizes = head_sizes(renderer)
+
+    try:
+        output = render(renderer, view, *args, **kw)
+    finally:
+        if token is not None:
+            _log.reset(token)
+
+    fragment = Fragment.record(output, log[start:], renderer, sizes) if key is not None else None
+    if fragment is not None:
+        if component._fragments is None:
+            component._fragments = {}
+
+        # Only the last fragment of a view is kept
+        component._fragments[key] = (context, fragment)
+
+    return output
+
+
+# -----------------------------------------------------------------------------------------------------
+
+
+def serialize(output):
+    if isinstance(output, (list, tuple)):
+        return ''.join(map(serialize, output))
+
+    return output if isinstance(output, str) else etree.tostring(output, encoding='unicode')
+
+
+class LRUCache:
+    """Thread-safe LRU cache, bounded by the size of the cached fragments."""
+
+    def __init__(self, max_size=10 * 1024 * 1024):
+        """Initialization.
+
+        In:
+          - ``max_size`` -- maximum cumulated size of the serialized fragments
+        """
+        self.max_size = max_size
+        self.size = self.hits = self.misses = 0
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+
+        return entry and entry[1:]
+
+    def set(self, key, size, output, head):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+
+            self.entries[key] = (size, output, head)
+            self.size += size
+
+            while self.size > self.max_size:
+                self.size -= self.entries.popitem(last=False)[1][0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = self.hits = self.misses = 0
+
+
+pure_views = LRUCache()
+
+
+def pure(key=None):
+    """Declare a view as pure: its rendering only depends on immutable data.
+
+    The rendering is shared by all the sessions, in ``pure_views``. It is not cached
+    if actions are registered or if the session id appears into it.
+
+    Usage:
+
+      @presentation.render_for(Menu)
+      @pure(key=lambda self: self.lang)
+      def render(self, h, comp, *args):
+          ...
+
+    In:
+      - ``key`` -- function called with the object, returning the explicit cache key
+
+    Return:
+      - the view decorator
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def render(self, renderer, comp, view, *args, **kw):
+            request = getattr(renderer, 'request', None)
+            cache_key = (
+                type(self),
+                f,
+                view,
+                key(self) if key is not None else None,
+                args,
+                tuple(kw.items()),
+                type(renderer),
+                getattr(renderer, 'url', None),
+                getattr(request, 'is_xhr', None),
+            )
+
+            try:
+                entry = pure_views.get(cache_key)
+            except TypeError:
+                return f(self, renderer, comp, view, *args, **kw)
+
+            if entry is not None:
+                output, head = entry
+                add_head_entries(renderer, head)
+
+                return copy.deepcopy(output)
+
+            outer_log = _log.get()
+            log = []
+            token = _log.set(log)
+            sizes = head_sizes(renderer)
+
+            try:
+                output = f(self, renderer, comp, view, *args, **kw)
+            finally:
+                _log.reset(token)
+
+            if outer_log is not None:
+                outer_log.extend(log)
+
+            if is_cacheable(output) and all(action_id is None for _, action_id, _ in log):
+                serialized = serialize(output)
+                session_id = getattr(renderer, 'session_id', None)
+
+                if (session_id is None) or (str(session_id) not in serialized):
+                    pure_views.set(cache_key, len(serialized), copy.deepcopy(output), new_head_entries(renderer, sizes))
+
+            return output
+
+        return render
+
+    return decorator
@@ -19,7 +19,7 @@ import webob
 import filetype
 
 from nagare import var
-from nagare.action import Action, Update
+from nagare.action import Action, Shared, Update
 from nagare.services import callbacks
 from nagare.renderers import xml, html_base
 from nagare.renderers.xml import TagProp
@@ -233,7 +233,7 @@ class TextArea(_HTMLActionTag):
           - ``self``
         """
         # The content sent to the action will have the '\r' characters removed
-        if not isinstance(action, Action):
+        if not isinstance(action, (Action, Shared)):
             args = (action,) + args
             action = self.clean_input_with_request if with_request else self.clean_input
 
@@ -469,6 +469,31 @@ class Error(html_base.Tag):
 
 
 class HeadRenderer(html_base.HeadRenderer):
+    def assets(self):
+        """Return the lists of the head assets.
+
+        Return:
+        - ``None`` or the lists of the named CSS, CSS urls, named javascripts and javascript urls
+        """
+        if not any((self._named_css, self._css_url, self._named_javascript, self._javascript_url)):
+            return None
+
+        return (
+            [(name, css, attrs) for name, (css, attrs, _) in sorted(self._named_css.items(), key=lambda e: e[1][2])],
+            [
+                (self.absolute_asset_url(url), attrs)
+                for url, (attrs, _) in sorted(self._css_url.items(), key=lambda e: e[1][1])
+            ],
+            [
+                (name, js, attrs)
+                for name, (js, attrs, _) in sorted(self._named_javascript.items(), key=lambda e: e[1][2])
+            ],
+            [
+                (self.absolute_asset_url(url), attrs)
+                for url, (attrs, _) in sorted(self._javascript_url.items(), key=lambda e: e[1][1])
+            ],
+        )
+
     def render_async(self):
         """Generate a javascript view of the head.
 
@@ -478,32 +503,11 @@ class HeadRenderer(html_base.HeadRenderer):
         Return:
         - a javascript string
         """
-        if not any((self._named_css, self._css_url, self._named_javascript, self._javascript_url)):
+        assets = self.assets()
+        if assets is None:
             return ''
 
-        return 'nagare.loadAll(%s, %s, %s, %s);' % (
-            json.dumps(
-                [(name, css, attrs) for name, (css, attrs, _) in sorted(self._named_css.items(), key=lambda e: e[1][2])]
-            ),
-            json.dumps(
-                [
-                    (self.absolute_asset_url(url), attrs)
-                    for url, (attrs, _) in sorted(self._css_url.items(), key=lambda e: e[1][1])
-                ]
-            ),
-            json.dumps(
-                [
-                    (name, js, attrs)
-                    for name, (js, attrs, _) in sorted(self._named_javascript.items(), key=lambda e: e[1][2])
-                ]
-            ),
-            json.dumps(
-                [
-                    (self.absolute_asset_url(url), attrs)
-                    for url, (attrs, _) in sorted(self._javascript_url.items(), key=lambda e: e[1][1])
-                ]
-            ),
-        )
+        return 'nagare.loadAll(%s, %s, %s, %s);' % tuple(json.dumps(asset) for asset in assets)
 
 
 class _SyncRenderer:
@@ -691,9 +695,7 @@ class _SyncRenderer:
             form(
                 self.div(
                     self.input(name='_s', value=self.session_id, type='hidden'),
-                    self.input(name='_c', value='%05d' % self.state_id, type='hidden')
-                    if self.state_id is not None
-                    else '',
+                    self.input(name='_c', value=str(self.state_id), type='hidden') if self.state_id is not None else '',
                     class_='nagare-generated nagare-session-data',
                 )
             )
@@ -711,7 +713,7 @@ class _SyncRenderer:
         if self.session_id is not None:
             params['_s'] = self.session_id
             if self.state_id is not None:
-                params['_c'] = '%05d' % self.state_id
+                params['_c'] = str(self.state_id)
 
         return self.absolute_url(url, **params)
 
@@ -727,7 +729,7 @@ class _SyncRenderer:
         if component is None:
             return
 
-        if not isinstance(action, Action):
+        if not isinstance(action, (Action, Shared)):
             action = self.default_action(action)
 
         action.register(self, component, tag, action_type, with_request, args, kw)
@@ -7,18 +7,68 @@
 # this distribution.
 # --
 
+import threading
+from collections import OrderedDict
+
 from webob.multidict import MultiDict, NestedMultiDict
 
 from nagare.server import mvc_application
 from nagare.services import router
 from nagare.renderers import html5
+from nagare.services.callbacks import ACTION_PREFIX, COMPACT_ACTION_PREFIX, parse_action, parse_actions
+
+# The legacy prefix is still accepted from the pages rendered before the compact ids
+PIPED_ACTIONS_PREFIXES = ('|' + ACTION_PREFIX, '|' + COMPACT_ACTION_PREFIX)
+
+
+def is_piped_actions(value):
+    """Is the value a list of callback identifiers, as '|<id>|<id>...|'?"""
+    return value.startswith(PIPED_ACTIONS_PREFIXES) and (parse_action(value[1:].partition('|')[0]) is not None)
 
 
 class Request(mvc_application.Request):
+    # Last sequence numbers received, by client key, from the ``X-Nagare-Sequence`` headers.
+    # Only the requests of the elements with the ``abort`` policy carry a sequence
+    MAX_SEQUENCES = 10000
+    sequences = OrderedDict()
+    sequences_lock = threading.Lock()
+
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
         self.client_params = {}
 
+        self.sequence = None
+        sequence = self.headers.get('X-Nagare-Sequence')
+        if sequence:
+            key, _, n = sequence.rpartition(':')
+            if key and n.isdigit():
+                self.sequence = key, int(n)
+                self.register_sequence(key, int(n))
+
+    @classmethod
+    def register_sequence(cls, key, n):
+        with cls.sequences_lock:
+            if n > cls.sequences.get(key, -1):
+                cls.sequences[key] = n
+                cls.sequences.move_to_end(key)
+
+                if len(cls.sequences) > cls.MAX_SEQUENCES:
+                    cls.sequences.popitem(last=False)
+
+    @property
+    def superseded(self):
+        """Was a newer request received from the same client element?
+
+        As the requests of a session are serialized, a request can be superseded
+        while waiting for the session lock. As only the ``abort`` policy sends
+        sequences, it was then aborted by the client.
+        """
+        if self.sequence is None:
+            return False
+
+        key, n = self.sequence
+        return self.sequences.get(key, n) > n
+
     @property
     def POST(self):
         if 'webob._parsed_post_vars' in self.environ:
@@ -27,12 +77,12 @@ class Request(mvc_application.Request):
             vars = MultiDict()
 
             for names, values in super().POST.items():
-                if names.startswith('|_action'):
+                if names.startswith(PIPED_ACTIONS_PREFIXES):
                     names = names.strip('|').split('|')
                     complement = names.pop(-1) if (names[-1] == '.x') or (names[-1] == '.y') else ''
                     for name in names:
                         vars.add(name + complement, values)
-                elif isinstance(values, str) and values.startswith('|_action'):
+                elif isinstance(values, str) and is_piped_actions(values):
                     for value in values.strip('|').split('|'):
                         vars.add(names, value)
                 else:
@@ -44,7 +94,24 @@ class Request(mvc_application.Request):
 
     @property
     def params(self):
-        return NestedMultiDict(super().params, self.client_params)
+        params = self.environ.get('nagare.params')
+        if params is None:
+            params = self.environ['nagare.params'] = NestedMultiDict(super().params, self.client_params)
+
+        return params
+
+    @property
+    def actions(self):
+        """Index of the callback identifiers received, parsed once per request.
+
+        Return:
+          - list of ((priority, callback type, callback id, complement, client params), values), by priority
+        """
+        actions = self.environ.get('nagare.actions')
+        if actions is None:
+            actions = self.environ['nagare.actions'] = parse_actions(self.params.items())
+
+        return actions
 
 
 class App(mvc_application.App):
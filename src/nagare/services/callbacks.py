@@ -15,15 +15,17 @@ import os
 import re
 import json
 import base64
+import string
+import inspect
 import contextlib
-from functools import partial
+from functools import partial, lru_cache
 from collections import defaultdict
 
 from webob import exc
 from tinyaes import AES
 
 from nagare.services import plugin
-from nagare.component import CallAnswered, call_wrapper
+from nagare.component import CallAnswered, call_wrapper, async_wrapper
 
 PRE_ACTION_CALLBACK = 0  # <form>.pre_action
 WITH_VALUE_CALLBACK = 1  # <textarea>, <input type="text">
@@ -36,27 +38,138 @@ IMAGE_CALLBACK = 7  # <input type='image'>
 
 WITH_CONTINUATION_CALLBACK = 1 << 4
 
+# Previous format of the callback identifiers, still accepted
 ACTION_PREFIX = '_action'
 ACTION_SYNTAX = re.compile(ACTION_PREFIX + r'((0|1)(\d))(\d+)((.x)|(.y))?(#(.*))?$')
 
+# Characters never escaped into the URLs and the form data, and rarely used by the field names
+COMPACT_ACTION_PREFIX = '_-'
+HEX_DIGITS = '0123456789ABCDEF'
+BASE62 = string.digits + string.ascii_letters
+BASE62_VALUES = {digit: i for i, digit in enumerate(BASE62)}
+
 callbacks_service = None
 
 
+def encode_action(action_type, action_id):
+    """Create a callback identifier.
+
+    In:
+      - ``action_type`` -- the callback type, with the ``WITH_CONTINUATION_CALLBACK`` flag
+      - ``action_id`` -- key into the callbacks dictionary
+
+    Return:
+      - '_-<continuation flag and callback type on 1 hex char><key in base 62>'
+    """
+    digits = []
+    while True:
+        action_id, digit = divmod(action_id, 62)
+        digits.append(BASE62[digit])
+        if not action_id:
+            break
+
+    flags = ((action_type & WITH_CONTINUATION_CALLBACK) >> 1) | (action_type & 7)
+
+    return COMPACT_ACTION_PREFIX + HEX_DIGITS[flags] + ''.join(reversed(digits))
+
+
+def parse_action(name):
+    """Parse a callback identifier, without regular expression.
+
+    The compact identifiers of ``encode_action()`` and the ``ACTION_SYNTAX`` ones
+    ('_action<continuation flag><priority><key>') are accepted.
+
+    In:
+      - ``name`` -- the callback identifier, optionally followed by '.x' or '.y' and '#<client params>'
+
+    Return:
+      - tuple (priority, callback type, callback id, complement, client params) or ``None``
+    """
+    if name.startswith(ACTION_PREFIX):
+        name, legacy = name[len(ACTION_PREFIX) :], True
+    elif name.startswith(COMPACT_ACTION_PREFIX):
+        name, legacy = name[len(COMPACT_ACTION_PREFIX) :], False
+    else:
+        return None
+
+    name, sep, client_params = name.partition('#')
+
+    complement = None
+    if name[-2:] in ('.x', '.y'):
+        name, complement = name[:-2], name[-2:]
+
+    if not name.isascii():
+        return None
+
+    if legacy:
+        if (len(name) < 3) or (name[0] not in '01') or not name.isdigit():
+            return None
+
+        callback_type = int(name[:2], 16)
+        callback_id = int(name[2:])
+    else:
+        if (len(name) < 2) or (name[0] not in HEX_DIGITS) or not name.isalnum():
+            return None
+
+        flags = HEX_DIGITS.index(name[0])
+        callback_type = ((flags & 8) << 1) | (flags & 7)
+
+        callback_id = 0
+        for digit in name[1:]:
+            callback_id = callback_id * 62 + BASE62_VALUES[digit]
+
+    return callback_type & 15, callback_type, callback_id, complement, client_params if sep else None
+
+
+def parse_actions(params):
+    """Index the callback identifiers received, in one pass.
+
+    In:
+      - ``params`` -- iterable of the (name, value) request parameters
+
+    Return:
+      - list of ((priority, callback type, callback id, complement, client params), values), by priority
+    """
+    actions = defaultdict(list)
+
+    for name, value in params:
+        action = parse_action(name)
+        if (action is None) and isinstance(value, str):
+            # For the radio buttons, the callback identifier is the value, not the name
+            action = parse_action(value)
+            if (action is not None) and (action[0] != WITHOUT_VALUE_CALLBACK):
+                action = None
+
+        if action is not None:
+            actions[action].append(value)
+
+    return sorted(actions.items(), key=lambda e: e[0][:2])
+
+
 class CallbackLookupError(LookupError):
     pass
 
 
 class CallbacksService(plugin.Plugin):
     CONFIG_SPEC = plugin.Plugin.CONFIG_SPEC | {
-        'key': 'string(min_len=24, max_len=24, default=None, help="base64-encoded 16 bytes key")'
+        'key': 'string(min_len=24, max_len=24, default=None, help="base64-encoded 16 bytes key")',
+        'client_params_cache': 'integer(default=4096, help="number of encrypted / decrypted client params kept")',
+        'async_timeout': 'float(default=None, help="seconds before an async action is cancelled")',
     }
     LOAD_PRIORITY = 110
 
-    def __init__(self, name, dist, key=None, **config):
+    def __init__(self, name, dist, key=None, client_params_cache=4096, async_timeout=None, **config):
         global callbacks_service
-        super().__init__(name, dist, **config)
+        super().__init__(name, dist, client_params_cache=client_params_cache, async_timeout=async_timeout, **config)
 
         self.key = os.urandom(16) if key is None else base64.b64decode(key)
+        self.async_timeout = async_timeout
+
+        # The encryption is deterministic (constant key and IV): the identical payloads,
+        # i.e. the same client params on many rows, are only encrypted / decrypted once
+        self.encrypt = lru_cache(client_params_cache)(self.encrypt)
+        self.decrypt = lru_cache(client_params_cache)(self.decrypt)
+
         callbacks_service = self
 
     @staticmethod
@@ -64,36 +177,103 @@ class CallbacksService(plugin.Plugin):
         nb = len(buf) % length
         return buf + padding * (nb and (length - nb))
 
-    def encode_client_params(self, client_params):
-        if not client_params:
-            return ''
+    def encrypt(self, client_params):
+        """Encrypt the JSON serialized client params.
+
+        A new cipher is created for each payload, as the ``tinyaes`` context keeps the
+        last CBC block as the IV of the next call and can't be reset.
+
+        In:
+          - ``client_params`` -- the JSON serialized client params
 
-        v = json.dumps(client_params).encode('utf-8')
-        v = self.pad(v + b'#', 16, b' ')
+        Return:
+          - the encrypted client params, base64 encoded
+        """
+        v = bytearray(self.pad(client_params.encode('utf-8') + b'#', 16, b' '))
         AES(self.key).CBC_encrypt_buffer_inplace_raw(v)
-        v = base64.urlsafe_b64encode(v).decode('ascii')
 
-        return v
+        return base64.urlsafe_b64encode(v).decode('ascii')
 
-    def decode_client_params(self, client_params):
-        if not client_params:
-            return {}
+    def decrypt(self, client_params):
+        """Decrypt the client params.
 
-        v = base64.urlsafe_b64decode(client_params)
+        In:
+          - ``client_params`` -- the encrypted client params, base64 encoded
+
+        Return:
+          - the JSON serialized client params
+        """
+        v = bytearray(base64.urlsafe_b64decode(client_params))
         AES(self.key).CBC_decrypt_buffer_inplace_raw(v)
         v = v.rstrip(b' ')
         if not v.endswith(b'#'):
             raise exc.HTTPNotFound()
 
-        return json.loads(v[:-1])
+        return v[:-1].decode('utf-8')
 
-    @staticmethod
-    def execute_callback(callback_type, callback, args, kw):
+    def encode_client_params(self, client_params):
+        return self.encrypt(json.dumps(client_params)) if client_params else ''
+
+    def decode_client_params(self, client_params):
+        return json.loads(self.decrypt(client_params)) if client_params else {}
+
+    def execute_callback(self, callback_type, callback, args, kw):
+        """Execute a callback.
+
+        An awaitable returned by the callback (i.e ``async def`` actions) is driven on the
+        shared actions event loop until it completes, is suspended by an ``await comp.call()``
+        or the ``async_timeout`` expires. In this last case, the action is cancelled, so the
+        session state is never changed outside of the request holding the session lock.
+        """
         with contextlib.suppress(CallAnswered):
             if callback_type & WITH_CONTINUATION_CALLBACK:
-                return call_wrapper(callback, *args, **kw)
+                r = call_wrapper(callback, *args, **kw)
             else:
-                return callback(*args, **kw)
+                r = callback(*args, **kw)
+
+            return async_wrapper(r, self.async_timeout) if inspect.isawaitable(r) else r
+
+    @staticmethod
+    def render_batch(renders, renderer):
+        renderer.response.content_type = 'application/json'
+        return json.dumps([render(renderer, batch_params=params) for render, params in renders])
+
+    def handle_batch(self, callbacks, batch):
+        """Prepare a batch of remote calls.
+
+        In:
+          - ``callbacks`` -- dictionary of the callback ids / callbacks
+          - ``batch`` -- JSON list of (action id of a remote function, parameters)
+
+        Return:
+          - the render function, calling the remote functions in order and returning the list of their results
+        """
+        renders = []
+
+        try:
+            batch = [(parse_action(name), params) for name, params in json.loads(batch)]
+        except (ValueError, TypeError, AttributeError):
+            raise exc.HTTPBadRequest('Invalid batch') from None
+
+        for action, params in batch:
+            if (action is None) or not isinstance(params, list):
+                raise exc.HTTPBadRequest('Invalid batch')
+
+            callback_id = action[2]
+            try:
+                render = callbacks[callback_id][2]
+            except KeyError:
+                exc_ = CallbackLookupError(callback_id)
+                exc_.__cause__ = None
+                raise exc_
+
+            # Only the remote functions can be called into a batch
+            if not getattr(getattr(getattr(render, 'func', None), '__self__', None), 'batch', False):
+                raise exc.HTTPBadRequest('Invalid batch')
+
+            renders.append((render, params))
+
+        return partial(self.render_batch, renders)
 
     def handle_request(self, chain, callbacks, request, response, root, **params):
         """Call the actions associated to the callback identifiers received.
@@ -107,32 +287,31 @@ class CallbacksService(plugin.Plugin):
         Return:
           - the render function
         """
-        # The structure of a callback identifier is
-        # '_action<with continuation on 1 char><priority on 1 chars><key into the callbacks dictionary>'
-        actions = defaultdict(list)
+        if getattr(request, 'superseded', False):
+            # A newer request was sent by the client element, this one was aborted
+            return chain.next(
+                callbacks=callbacks, request=request, response=response, root=root, render=lambda h: '', **params
+            )
 
-        for name, value in request.params.items():
-            if isinstance(value, str) and value.startswith(ACTION_PREFIX):
-                name = value  # For the radio buttons, the callback identifier is the value, not the name
+        # Parsed once per request, see ``parse_action()`` for the structure of a callback identifier
+        actions = getattr(request, 'actions', None)
+        if actions is None:
+            actions = parse_actions(request.params.items())
 
-            m = ACTION_SYNTAX.match(name)
-            if m:
-                groups = m.groups()
-                actions[(int(groups[2]), int(groups[0], 16), groups[3], groups[4], groups[-1])].append(value)
+        render = self.handle_batch(callbacks, request.params['_batch']) if '_batch' in request.params else None
 
-        render = None
+        # The client lost the HTML a patch was based on and asks for the rendering again
+        refresh = 'X-Nagare-Refresh' in request.headers
 
-        for (type_, callback_type, callback_id, complement, client_params), values in sorted(
-            actions.items(), key=lambda e: (e[0][0], e[0][1])
-        ):
+        for (type_, callback_type, callback_id, complement, client_params), values in actions:
             try:
-                f, with_request, render, callback_args, kw = callbacks[int(callback_id)]
+                f, with_request, render, callback_args, kw = callbacks[callback_id]
             except KeyError:
                 exc = CallbackLookupError(callback_id)
                 exc.__cause__ = None
                 raise exc
 
-            if f is None:
+            if (f is None) or refresh:
                 continue
 
             callback_params = self.decode_client_params(client_params) | kw
@@ -20,7 +20,7 @@ def exception_handler(exception, exceptions_service, request, **context):
         # can be not found (i.e deleted by a previous XHR)
         # In this case, do nothing
         if request.is_xhr:
-            exceptions_service.logger.warning('Callback lookup error in XHR request')
+            exceptions_service.logger.warning('Callback lookup error in XHR request (expired or evicted action)')
             exception = exc.HTTPOk()
         else:
             exceptions_service.log_exception('nagare.services.callbacks')
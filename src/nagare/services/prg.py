@@ -24,7 +24,7 @@ class PRGService(plugin.Plugin):
     @staticmethod
     def handle_request(chain, request, response, session_id, state_id, **params):
         if (request.method == 'POST') and not request.is_xhr:
-            response = request.create_redirect_response(response=response, _s=session_id, _c='%05d' % state_id)
+            response = request.create_redirect_response(response=response, _s=session_id, _c=str(state_id))
         else:
             response = chain.next(
                 request=request, response=response, session_id=session_id, state_id=state_id, **params
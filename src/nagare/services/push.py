@@ -0,0 +1,232 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""Server push of updates to the open pages of a session.
+
+The pages listen to a server-sent events stream. The server code pushes javascript
+commands (i.e. DOM updates) or values for the ``nagare.onPush()`` listeners.
+
+The stream URL of a session is signed: only the pages rendered for the session
+can open it, not the holders of the session id alone.
+
+With a threaded WSGI server, each open stream holds a worker thread as long as
+its page is open. So ``max_streams`` must be lower than the number of threads,
+keeping threads for the other requests, or an asynchronous server must be used.
+"""
+
+import os
+import hmac
+import json
+import queue
+import base64
+import hashlib
+import threading
+from collections import defaultdict
+
+from webob import Response, exc
+
+from nagare.action import generate_part
+from nagare.services import plugin
+from nagare.services.http_session import SessionService
+
+push_service = None
+
+
+class Broker:
+    """In-process broker, dispatching the events to the subscribers of a channel."""
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Subscribe to a channel.
+
+        In:
+          - ``channel`` -- the channel
+
+        Return:
+          - the queue receiving the events
+        """
+        q = queue.SimpleQueue()
+
+        with self.lock:
+            self.channels[channel].add(q)
+
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self.lock:
+            subscribers = self.channels.get(channel, set())
+            subscribers.discard(q)
+
+            if not subscribers:
+                self.channels.pop(channel, None)
+
+    def publish(self, channel, event, data):
+        """Send an event to all the subscribers of a channel.
+
+        In:
+          - ``channel`` -- the channel
+          - ``event`` -- the event name (``None`` for the javascript commands)
+          - ``data`` -- the event data
+
+        Return:
+          - the number of subscribers
+        """
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+
+        for q in subscribers:
+            q.put((event, data))
+
+        return len(subscribers)
+
+
+class PushService(plugin.Plugin):
+    # Handled before the session is locked, as the stream stays open
+    LOAD_PRIORITY = SessionService.LOAD_PRIORITY - 1
+    CONFIG_SPEC = plugin.Plugin.CONFIG_SPEC | {
+        'keepalive': 'integer(default=30, help="seconds between two keepalive messages")',
+        'retry': 'integer(default=3000, help="milliseconds before the browser reconnects")',
+        'max_streams': 'integer(default=0, help="maximum number of open streams, 0 for no limit")',
+        'key': 'string(min_len=24, max_len=24, default=None, help="base64-encoded 16 bytes key")',
+    }
+
+    def __init__(self, name, dist, keepalive, retry, max_streams=0, key=None, **config):
+        global push_service
+
+        super().__init__(name, dist, keepalive=keepalive, retry=retry, max_streams=max_streams, key=key, **config)
+
+        self.keepalive = keepalive
+        self.retry = retry
+        self.max_streams = max_streams
+        self.key = os.urandom(16) if key is None else base64.b64decode(key)
+        self.broker = Broker()
+
+        self.nb_streams = 0
+        self.lock = threading.Lock()
+
+        push_service = self
+
+    def publish(self, session_id, data, event=None):
+        """Push data to the open pages of a session.
+
+        In:
+          - ``session_id`` -- the session id
+          - ``data`` -- javascript commands or, for an event listened by ``nagare.onPush()``, a JSON value
+          - ``event`` -- the event name
+
+        Return:
+          - the number of pages the data were pushed to
+        """
+        return self.broker.publish(str(session_id), event, data if event is None else json.dumps(data))
+
+    def update(self, session_id, id_, html):
+        """Replace a DOM element into the open pages of a session.
+
+        In:
+          - ``session_id`` -- the session id
+          - ``id_`` -- the DOM id of the element
+          - ``html`` -- the new HTML tree or string
+        """
+        if not isinstance(html, str):
+            html = html.tostring().decode('utf-8')
+
+        return self.publish(session_id, generate_part(False, 'replaceNode', id_, payload=html).decode('utf-8'))
+
+    def listen(self, renderer):
+        """Make the page rendered to listen to the pushed data.
+
+        In:
+          - ``renderer`` -- the current renderer
+        """
+        if renderer.session_id is not None:
+            url = renderer.absolute_url('', _s=renderer.session_id, _push=self.sign(renderer.session_id))
+            renderer.head.javascript('nagare-push', 'nagare.listen(%s);' % json.dumps(url))
+
+    def sign(self, session_id):
+        """Credential of a session to open its stream.
+
+        In:
+          - ``session_id`` -- the session id
+
+        Return:
+          - the signature of the session id
+        """
+        signature = hmac.new(self.key, str(session_id).encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(signature[:16]).decode('ascii').rstrip('=')
+
+    def stream(self, session_id):
+        """Open the events stream of a page.
+
+        In:
+          - ``session_id`` -- the session id
+
+        Return:
+          - the stream, as an iterator of bytes, or ``None`` if ``max_streams`` are already open
+        """
+        with self.lock:
+            if self.max_streams and (self.nb_streams >= self.max_streams):
+                return None
+
+            self.nb_streams += 1
+
+        stream = self._stream(session_id)
+        next(stream)
+
+        return stream
+
+    def _stream(self, session_id):
+        q = self.broker.subscribe(session_id)
+
+        try:
+            # Started by ``stream()``: the stream slot is released when closed, even if never iterated
+            yield
+
+            yield b'retry: %d\n\n' % self.retry
+
+            while True:
+                try:
+                    event, data = q.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+                    continue
+
+                message = ''.join('data: %s\n' % line for line in data.split('\n'))
+                if event is not None:
+                    message = 'event: %s\n' % event + message
+
+                yield message.encode('utf-8') + b'\n'
+        finally:
+            self.broker.unsubscribe(session_id, q)
+
+            with self.lock:
+                self.nb_streams -= 1
+
+    def handle_request(self, chain, request, response, **params):
+        session_id = request.params.get('_s')
+
+        if (request.method != 'GET') or ('_push' not in request.params) or not session_id:
+            return chain.next(request=request, response=response, **params)
+
+        # Compared as bytes, as ``compare_digest()`` rejects the not ASCII strings
+        if not hmac.compare_digest(request.params['_push'].encode('utf-8'), self.sign(session_id).encode('ascii')):
+            raise exc.HTTPForbidden()
+
+        stream = self.stream(session_id)
+        if stream is None:
+            # The browser doesn't reconnect after an error status: the page falls back to its requests
+            raise exc.HTTPServiceUnavailable()
+
+        response = Response(content_type='text/event-stream', app_iter=stream)
+        response.cache_control = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # No buffering by the proxies
+
+        return response
@@ -7,7 +7,11 @@
 # this distribution.
 # --
 
+import io
+import pickle
+from functools import partial
 
+from nagare import fragments
 from nagare.component import Component
 from nagare.services.http_session import SessionService
 
@@ -23,6 +27,9 @@ def persistent_id(o, clean_callbacks, result):
     - ``result`` -- object with attributes:
       - ``callbacks`` -- merge of the callbacks from all the components
       - ``session_data`` -- dict persistent_id -> object of the objects to store into the session
+      - ``changes`` -- if ``track_changes`` is set, list of the changed components
+      - ``untracked`` -- if ``track_changes`` is set, list of the other components
+        wrapping objects not ``state.Tracked``, which can have changed
 
     Return:
     - the persistent id or ``None``
@@ -37,26 +44,120 @@ def persistent_id(o, clean_callbacks, result):
     return r
 
 
+def actions_size(actions):
+    """Estimate the pickled size of actions.
+
+    The objects referenced by the actions, also pickled with their components, are not counted.
+
+    In:
+    - ``actions`` -- dictionary of action ids / actions
+
+    Return:
+    - the number of bytes
+    """
+    f = io.BytesIO()
+
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda o: None if type(o) in (dict, tuple, str, bytes, int, float, bool) else id(o)
+    pickler.dump(actions)
+
+    return f.tell()
+
+
 class StateService(SessionService):
     LOAD_PRIORITY = SessionService.LOAD_PRIORITY + 1
     CONFIG_SPEC = SessionService.CONFIG_SPEC | {
         'states_history': 'boolean(default=True)',
         'session_cookie': {'name': 'string(default="")'},
         'send_response': 'boolean(default=True)',
+        'max_actions': 'integer(default=0, help="maximum number of actions kept by component, 0 for no limit")',
+        'track_changes': 'boolean(default=False, help="report the components changed since the last snapshot")',
     }
 
-    def __init__(self, name, dist, send_response, services_service, session_service, **config):
-        services_service(super().__init__, name, dist, send_response=send_response, **config)
+    def __init__(
+        self,
+        name,
+        dist,
+        send_response,
+        max_actions,
+        track_changes,
+        services_service,
+        session_service,
+        **config,
+    ):
+        services_service(
+            super().__init__,
+            name,
+            dist,
+            send_response=send_response,
+            max_actions=max_actions,
+            track_changes=track_changes,
+            **config,
+        )
 
         session_service.set_persistent_id(persistent_id)
         session_service.set_dispatch_table(self.set_dispatch_table)
 
         self.send_response = send_response
+        self.max_actions = max_actions
+        self.track_changes = track_changes
+        fragments.changes_tracked = track_changes
+
+        self.evicted_actions = self.evicted_bytes = 0
 
     def set_dispatch_table(self, clean_callbacks, result):
-        return {Component: lambda comp: comp.reduce(clean_callbacks, result)}
+        if not self.max_actions and not self.track_changes:
+            return {Component: lambda comp: comp.reduce(clean_callbacks, result)}
+
+        changes = untracked = None
+        if self.track_changes:
+            # Components changed since the last snapshot, for the sessions store
+            # to write only the changed subgraphs. See ``changed_components()``
+            result.changes = changes = []
+            result.untracked = untracked = []
+
+        return {Component: partial(self.reduce, clean_callbacks, result, changes, untracked)}
+
+    @staticmethod
+    def changed_components(result):
+        """Return the components to write into a snapshot based on the previous one.
+
+        To be called by the sessions store after the serialization of the state with
+        the dispatch table of ``set_dispatch_table()``.
+
+        In:
+          - ``result`` -- the result object given to ``set_dispatch_table()``
+
+        Return:
+          - the changed components, then the ones wrapping an object not tracked,
+            or ``None`` if the changes are not tracked
+        """
+        changes = getattr(result, 'changes', None)
+        return None if changes is None else changes + result.untracked
+
+    def reduce(self, clean_callbacks, result, changes, untracked, comp):
+        """Serialize a component, evicting its oldest actions and tracking its changes.
+
+        The evicted actions will raise a ``CallbackLookupError``, ignored in XHR requests.
+        """
+        evicted = {}
+        r = comp.reduce(clean_callbacks, result, self.max_actions, evicted, changes, untracked)
+
+        if evicted:
+            size = actions_size(evicted)
+
+            self.evicted_actions += len(evicted)
+            self.evicted_bytes += size
+            self.logger.debug('%d actions evicted, %d bytes saved', len(evicted), size)
+
+        return r
 
     def _handle_request(self, request, start_response, response, **params):
+        """Send the response, before the state is saved if ``send_response`` is set.
+
+        The body is sent in one piece: the whole tree of the page is rendered, and
+        all the actions registered, before its serialization.
+        """
         write = start_response(response.status, response.headerlist)
 
         if self.send_response and (write is not None):
@@ -0,0 +1,204 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+"""WebSocket transport of the asynchronous requests.
+
+A page opens a persistent WebSocket and sends its XHR requests through it. Each
+message is dispatched as a normal request through the rest of the services
+chain (sessions, callbacks, rendering). The WebSocket is provided by the server
+into ``environ['wsgi.websocket']`` (``receive()`` / ``send()`` API). Without it,
+the HTTP requests are still used.
+
+The messages go through the exceptions service, as the HTTP requests. The
+response headers are forwarded, except the ``HttpOnly`` cookies, which only an
+HTTP response can set.
+"""
+
+import io
+import json
+import urllib.parse
+
+from webob import Response, exc
+
+from nagare.services import plugin
+from nagare.services.http_session import SessionService
+
+websocket_service = None
+
+# Headers of the HTTP connection, not of the responses. The cookies are sent apart
+NOT_FORWARDED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'set-cookie'}
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ws': 80, 'wss': 443}
+
+
+def same_origin(origin, host, scheme):
+    """Is the ``Origin`` of the WebSocket upgrade the host of the application?
+
+    In:
+      - ``origin`` -- ``Origin`` header, as ``<scheme>://<host>[:<port>]``
+      - ``host`` -- ``Host`` header of the upgrade request, as ``<host>[:<port>]``
+      - ``scheme`` -- scheme of the upgrade request
+
+    Return:
+      - a boolean
+    """
+    try:
+        origin = urllib.parse.urlsplit(origin)
+        host = urllib.parse.urlsplit('//' + host)
+        origin_port = origin.port or DEFAULT_PORTS.get(origin.scheme)
+        host_port = host.port or DEFAULT_PORTS.get(scheme)
+    except ValueError:
+        return False
+
+    return (origin.hostname is not None) and (origin.hostname == host.hostname) and (origin_port == host_port)
+
+
+class WebSocketService(plugin.Plugin):
+    # Handled before the session is locked, as the WebSocket stays open
+    LOAD_PRIORITY = SessionService.LOAD_PRIORITY - 1
+
+    def __init__(self, name, dist, exceptions_service=None, **config):
+        global websocket_service
+
+        super().__init__(name, dist, **config)
+        self.exceptions_service = exceptions_service
+        websocket_service = self
+
+    @staticmethod
+    def connect(renderer):
+        """Make the page rendered to send its asynchronous requests through a WebSocket.
+
+        In:
+          - ``renderer`` -- the current renderer
+        """
+        if renderer.session_id is not None:
+            url = renderer.absolute_url('', _s=renderer.session_id, _ws='')
+            renderer.head.javascript('nagare-ws', 'nagare.connect(%s);' % json.dumps(url))
+
+    @staticmethod
+    def create_environ(environ, message):
+        """Create the WSGI environment of a request received through the WebSocket.
+
+        In:
+          - ``environ`` -- the WSGI environment of the WebSocket connection
+          - ``message`` -- the request, as a dictionary
+
+        Return:
+          - the new WSGI environment
+        """
+        url = urllib.parse.urlsplit(message['url'])
+        body = message.get('body', '').encode('utf-8')
+
+        environ = dict(environ)
+        environ.pop('wsgi.websocket', None)
+        for key in ('webob._parsed_post_vars', 'webob.adhoc_attrs', 'nagare.params', 'nagare.actions'):
+            environ.pop(key, None)
+        environ.update(
+            {
+                'REQUEST_METHOD': message.get('method', 'GET'),
+                'QUERY_STRING': url.query,
+                'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest',
+                'HTTP_ACCEPT': message.get('accept', '*/*'),
+                'CONTENT_TYPE': 'application/x-www-form-urlencoded' if body else '',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body),
+            }
+        )
+
+        # Only the nagare headers are forwarded, the others are the ones of the connection
+        for name, value in message.get('headers', {}).items():
+            if name.lower().startswith('x-nagare-'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        return environ
+
+    def handle_exception(self, exception, **context):
+        """Turn an exception raised by a request into a response, as for the HTTP requests.
+
+        In:
+          - ``exception`` -- the exception raised
+          - ``context`` -- the request, response and other parameters of the request
+
+        Return:
+          - the HTTP exception to send back
+        """
+        if self.exceptions_service is not None:
+            return self.exceptions_service.handle_exception(exception, **context)
+
+        if isinstance(exception, exc.HTTPException):
+            return exception
+
+        raise exception
+
+    def handle_message(self, chain, request, response, message, **params):
+        """Dispatch a request received through the WebSocket.
+
+        Return:
+          - the response message, as a dictionary
+        """
+        status_headers = []
+        body = []
+
+        def start_response(status, headers, exc_info=None):
+            status_headers[:] = [status, headers]
+            return body.append
+
+        environ = self.create_environ(request.environ, message)
+        params['start_response'] = start_response
+        request = type(request)(environ, charset='utf-8')
+        response = type(response)()
+
+        try:
+            r = chain.next(request=request, response=response, **params)
+        except Exception as exception:
+            r = self.handle_exception(exception, request=request, response=response, **params)
+
+        body.extend(r(environ, start_response))
+
+        status, headers = status_headers
+
+        cookies = [
+            v for k, v in headers if (k.lower() == 'set-cookie') and ('httponly' not in v.lower().replace(' ', ''))
+        ]
+        headers = {k.lower(): v for k, v in headers if k.lower() not in NOT_FORWARDED_HEADERS}
+
+        return {
+            'id': message['id'],
+            'status': int(status.split()[0]),
+            'headers': headers,
+            'cookies': cookies,
+            'body': b''.join(body).decode('utf-8'),
+        }
+
+    def handle_request(self, chain, request, response, **params):
+        ws = request.environ.get('wsgi.websocket')
+
+        if (ws is None) or ('_ws' not in request.params):
+            return chain.next(request=request, response=response, **params)
+
+        # The session cookie is sent with the upgrade request: only the pages of the application can connect
+        origin = request.headers.get('Origin')
+        if (origin is not None) and not same_origin(origin, request.host, request.scheme):
+            self.logger.warning('WebSocket connection from the foreign origin %r', origin)
+            return exc.HTTPForbidden()
+
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+
+            message = json.loads(message)
+            try:
+                r = self.handle_message(chain, request, response, message, **params)
+            except Exception:
+                self.logger.exception('WebSocket request error')
+                r = {'id': message['id'], 'status': 500, 'headers': {}, 'cookies': [], 'body': ''}
+
+            ws.send(json.dumps(r))
+
+        return Response(status=200)
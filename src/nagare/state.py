@@ -7,7 +7,7 @@
 # this distribution.
 # --
 
-"""Helper to mark an object as stateless."""
+"""Helpers to mark an object as stateless and to track the changes of the objects."""
 
 import random
 
@@ -41,3 +41,66 @@ def stateful(o):
         del o._persistent_id
 
     return o
+
+
+class Tracked:
+    """Mixin tracking the attributes writes of an object.
+
+    The objects not inheriting from this mixin are always considered as changed.
+
+    .. warning::
+        Only the assignments of attributes are seen. After an in-place change
+        (i.e. a ``var.Var`` set, a list or a dict modified), call ``touch()``.
+    """
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        super().__setattr__('_dirty', True)
+
+    def __delattr__(self, name):
+        super().__delattr__(name)
+        super().__setattr__('_dirty', True)
+
+
+def is_tracked(o):
+    """Are the changes of an object tracked?
+
+    In:
+      - ``o`` -- the object
+
+    Return:
+      - a boolean
+    """
+    return isinstance(o, Tracked)
+
+
+def is_dirty(o):
+    """Was an object changed since the last snapshot?
+
+    In:
+      - ``o`` -- the object
+
+    Return:
+      - a boolean, always ``True`` for an object not tracked
+    """
+    return getattr(o, '_dirty', True)
+
+
+def clean(o):
+    """Mark an object as unchanged.
+
+    In:
+      - ``o`` -- the object
+    """
+    if isinstance(o, Tracked):
+        object.__setattr__(o, '_dirty', False)
+
+
+def touch(o):
+    """Mark an object as changed.
+
+    In:
+      - ``o`` -- the object
+    """
+    if isinstance(o, Tracked):
+        object.__setattr__(o, '_dirty', True)
@@ -0,0 +1,52 @@
+"use strict";class Nagare{constructor(error){document.addEventListener("click",(evt)=>this.processClick(evt),true);this.nagare_loaded_named_js={};this.nagare_html={};this.ws=null;this.ws_requests={};this.ws_id=0;this.remote_calls=[];this.page_id=Math.random().toString(36).slice(2);this.policies=new Map();if(error)this.error=error;}
+evalCSS(name,css,attrs){if(css.length){var style=document.createElement("style");style.setAttribute("type","text/css");style.setAttribute("data-nagare-css",name);for(var name in attrs)style.setAttribute(name,attrs[name]);if(style.styleSheet)style.styleSheet.cssText=css;else style.appendChild(document.createTextNode(css));document.head.appendChild(style);}}
+evalJS(name,js,attrs){if(!this.nagare_loaded_named_js[name])setTimeout(js,0);this.nagare_loaded_named_js[name]=true;}
+fetchCSS(url,attrs){var link=document.createElement("link");link.setAttribute("rel","stylesheet");link.setAttribute("type","text/css");link.setAttribute("href",url);for(var name in attrs)link.setAttribute(name,attrs[name]);document.head.appendChild(link);}
+fetchJS(url,attrs){var script=document.createElement("script");script.setAttribute("type","text/javascript");script.setAttribute("src",url);for(var name in attrs)script.setAttribute(name,attrs[name]);document.head.appendChild(script);}
+loadAll(named_css,css,named_js,js){for(var i=0;i<named_css.length;i++){var name=named_css[i][0];var selector="[data-nagare-css='"+name+"']";if(!document.head.querySelector(selector))this.evalCSS(name,named_css[i][1],named_css[i][2]);}
+for(var i=0;i<named_js.length;i++){var name=named_js[i][0];var selector="[data-nagare-js='"+name+"']";if(!document.head.querySelector(selector))this.evalJS(name,named_js[i][1],named_js[i][2]);}
+for(var i=0;i<css.length;i++){var url=css[i][0];var a=document.createElement("a");var links=document.head.querySelectorAll("link[rel=stylesheet]");for(var j=0,found=false;!found&&j<links.length;j++){a.href=links[j].href;found=a.host==window.location.host&&a.pathname==url;}
+if(!found)this.fetchCSS(url,css[i[1]]);}
+for(var i=0;i<js.length;i++){var url=js[i][0];var selector="script[src='"+url+"']";if(!document.head.querySelector(selector))this.fetchJS(url,css[i[1]]);}}
+createNode(node,html){var e=document.createElement(node.parentNode.tagName);e.innerHTML=html;var new_node=e.children[0];new_node.querySelectorAll("script").forEach((js)=>{if(js.getAttribute("src")){var script=document.createElement("script");[...js.attributes].forEach((attr)=>script.setAttribute(attr.nodeName,attr.nodeValue));js.parentNode.replaceChild(script,js);}else{js.parentNode.removeChild(js);setTimeout(js.textContent,0);}});return new_node;}
+replaceNode(id,html){var node=document.getElementById(id);if(node&&html){this.nagare_html[id]=html;node.parentNode.replaceChild(this.createNode(node,html),node);}}
+crc32(s){if(!this.crc32_table){this.crc32_table=new Uint32Array(256);for(var i=0;i<256;i++){var c=i;for(var k=0;k<8;k++)c=c&1?0xedb88320^(c>>>1):c>>>1;this.crc32_table[i]=c;}}
+var crc=0xffffffff;for(const b of new TextEncoder().encode(s))crc=this.crc32_table[(crc^b)&0xff]^(crc>>>8);return(crc^0xffffffff)>>>0;}
+morphNode(node,new_node){if(node.nodeType!==new_node.nodeType||node.nodeName!==new_node.nodeName){node.parentNode.replaceChild(new_node,node);}else if(node.nodeType!==Node.ELEMENT_NODE){if(node.nodeValue!==new_node.nodeValue)node.nodeValue=new_node.nodeValue;}else if(!node.isEqualNode(new_node)){[...node.attributes].forEach((attr)=>{if(!new_node.hasAttribute(attr.name))node.removeAttribute(attr.name);});[...new_node.attributes].forEach((attr)=>{if(node.getAttribute(attr.name)!==attr.value)node.setAttribute(attr.name,attr.value);});var children=[...node.childNodes];var new_children=[...new_node.childNodes];if(children.length!==new_children.length)node.replaceChildren(...new_children);else children.forEach((child,i)=>this.morphNode(child,new_children[i]));}}
+patchNode(id,crc,prefix,suffix,middle){var node=document.getElementById(id);var html=this.nagare_html[id];if(!node||html===undefined||this.crc32(html)!==crc){window.location.reload();}else{html=html.slice(0,prefix)+middle+html.slice(html.length-suffix);this.nagare_html[id]=html;this.morphNode(node,this.createNode(node,html));}}
+error(status,text){document.open();document.write(text);document.close();}
+connect(url){var ws=new WebSocket(new URL(url,window.location.href).href.replace(/^http/,"ws"));ws.onopen=()=>(this.ws=ws);ws.onclose=()=>{this.ws=null;var requests=this.ws_requests;this.ws_requests={};for(var id in requests)requests[id][1](new Error("WebSocket closed"));};ws.onmessage=(event)=>{var message=JSON.parse(event.data);var request=this.ws_requests[message.id];delete this.ws_requests[message.id];var response=new Response(message.status===204?null:message.body,{status:message.status,headers:message.headers,});if(request)request[0](response);};}
+fetch(url,options){var body=options.body;if(!this.ws||(body&&[...body.values()].some((value)=>value instanceof File)))return fetch(url,options);var id=++this.ws_id;var message={id:id,url:new URL(url,window.location.href).href,method:options.method,accept:options.headers.Accept||"*/*",body:body?new URLSearchParams(body).toString():"",};return new Promise((resolve,reject)=>{this.ws_requests[id]=[resolve,reject];this.ws.send(JSON.stringify(message));});}
+sendRequest(url,options){options.cache="no-cache";options.headers=Object.assign({"X-REQUESTED-WITH":"XMLHttpRequest"},options.headers);options.credentials="same-origin";return this.fetch(url,options).catch(function(){throw new Error("Network error");}).then(function(response){var status=response.status;if(!response.ok){if(status===503&&response.headers.get("location")){window.document.location=response.headers.get("location");}else{response.text().then((text)=>this.error(status,text));}
+response=Promise.reject("Server error");}
+return response;}.bind(this),);}
+callRemote(url,policy){if(policy)
+return(...params)=>this.sendWithPolicy(url+"&_params="+encodeURIComponent(JSON.stringify(params)),policy,url,(response)=>response.json(),);return(...params)=>new Promise((resolve,reject)=>{if(!this.remote_calls.length)queueMicrotask(()=>this.sendRemoteCalls());this.remote_calls.push([url,params,resolve,reject]);});}
+sendRemoteCalls(){var batches={};this.remote_calls.forEach((call)=>{var url=new URL(call[0],window.location.href);var action=[...url.searchParams.keys()].find((name)=>/^_a(ction)?[0-9A-F]/.test(name));url.searchParams.delete(action);var base=url.href;if(!batches[base])batches[base]=[];batches[base].push([action,call]);});this.remote_calls=[];for(const[base,calls]of Object.entries(batches)){var request;if(calls.length===1){var[url,params]=calls[0][1];request=this.sendRequest(url+"&_params="+encodeURIComponent(JSON.stringify(params)),{method:"GET"}).then((response)=>response.json()).then((r)=>[r]);}else{var data=new FormData();data.append("_batch",JSON.stringify(calls.map(([action,call])=>[action,call[1]])));request=this.sendRequest(base,{method:"POST",body:data}).then((response)=>response.json());}
+request.then((results)=>calls.forEach(([action,call],i)=>call[2](results[i])),(e)=>calls.forEach(([action,call])=>call[3](e)),);}}
+delay(url){return(t,...params)=>new Promise((resolve)=>setTimeout(resolve,t,params)).then((args)=>this.callRemote(url)(...args));}
+repeat(url,options){options=Object.assign({backoff:2,max_interval:60000,pause_hidden:true},options);var fetchOptions={method:"GET",cache:"no-cache",credentials:"same-origin",headers:{"X-REQUESTED-WITH":"XMLHttpRequest"},};class _repeat{constructor(t,url,args){this.interval=this.delay=t;this.url=url+"&_params="+encodeURIComponent(JSON.stringify(args));this.schedule();}
+schedule(){setTimeout(()=>this.tick(),this.delay);}
+tick(){if(options.pause_hidden&&document.hidden){document.addEventListener("visibilitychange",()=>this.tick(),{once:true});return;}
+nagare.fetch(this.url,Object.assign({},fetchOptions)).then((response)=>{var interval=response.headers.get("X-Nagare-Interval");if(interval)this.interval=parseInt(interval);var retry=response.headers.get("Retry-After");if(!response.ok){this.delay=retry?parseInt(retry)*1000:this.backoff();if(this.onCatch)this.onCatch(new Error("Server error "+response.status));return;}
+this.delay=retry?parseInt(retry)*1000:response.status===204?this.backoff():this.interval;if(response.status!==204)return response.json().then((r)=>this.onThen&&this.onThen(r));}).catch((e)=>{this.delay=this.backoff();if(this.onCatch)this.onCatch(e);}).finally(()=>this.schedule());}
+backoff(){return Math.min(this.delay*options.backoff,options.max_interval);}
+then(f){this.onThen=f;return this;}
+catch(f){this.onCatch=f;return this;}}
+return(t,...params)=>new _repeat(t,url,params);}
+listen(url){this.push=new EventSource(url);this.push.onmessage=(event)=>(0,eval)(event.data);return this.push;}
+onPush(event,f){this.push.addEventListener(event,(e)=>f(JSON.parse(e.data)));}
+getField(field){return encodeURIComponent(field.type==="checkbox"&&!field.checked?"":field.value);}
+processParts(data){var bytes=new Uint8Array(data);var decoder=new TextDecoder();for(var i=0;i<bytes.length;){var eol=bytes.indexOf(10,i);var[command,length,...args]=decoder.decode(bytes.subarray(i,eol)).split(" ");i=eol+1+parseInt(length);var payload=decoder.decode(bytes.subarray(eol+1,i));switch(command){case"replaceNode":this.replaceNode(args[0],payload);break;case"patchNode":this.patchNode(args[0],parseInt(args[1]),parseInt(args[2]),parseInt(args[3]),payload);break;case"loadAll":this.loadAll(...JSON.parse(payload));break;}}}
+evalResponse(response){return(response.headers.get("content-type")||"").startsWith("application/x-nagare-parts")?response.arrayBuffer().then((data)=>this.processParts(data)):response.text().then(eval);}
+sendAndEval(url,options){options.headers=Object.assign({Accept:"application/x-nagare-parts, text/plain"},options.headers);return this.sendRequest(url,options).catch(Promise.reject).then((response)=>this.evalResponse(response)).catch((x)=>undefined);}
+sendWithPolicy(url,policy,key,process){var state=this.policies.get(key);if(!state){state={id:this.policies.size,seq:0,timer:null,controller:null,next:null};this.policies.set(key,state);}
+return new Promise((resolve,reject)=>{var send=()=>{if(policy.coalesce&&state.controller){state.next=send;return;}
+if(policy.abort&&state.controller)state.controller.abort();var controller=(state.controller=new AbortController());var seq=++state.seq;var options={method:"GET",signal:controller.signal,headers:{Accept:"application/x-nagare-parts, text/plain","X-Nagare-Sequence":this.page_id+"-"+state.id+":"+seq,},};this.sendRequest(url,options).then((response)=>(seq===state.seq?process(response):undefined)).then(resolve,reject).finally(()=>{if(state.controller===controller)state.controller=null;var next=state.next;state.next=null;if(next)next();});};if(policy.debounce){clearTimeout(state.timer);state.timer=setTimeout(send,policy.debounce);}else send();});}
+getAndEval(url,policy,element){if(policy)
+this.sendWithPolicy(url,policy,element||url,(response)=>this.evalResponse(response)).catch((x)=>undefined,);else this.sendAndEval(url,{method:"GET"});}
+postAndEval(form,action1,action2){var data=new FormData(form);if(action1)data.append(action1[0],action1[1]);if(action2)data.append(action2[0],action2[1]);return this.sendAndEval("?",{method:"POST",body:data});}
+processClick(event){var target=event.target;if(!("nagare"in target.dataset)){target=event.target.closest("a");if(target){if(!("nagare"in target.dataset)){return true;}}else{target=event.target.closest("button");if(!target||!("nagare"in target.dataset)){return true;}}}
+switch(target.dataset["nagare"][1]){case"5":var action=target.getAttribute("href");var policy=target.dataset["nagarePolicy"];this.getAndEval(action,policy&&JSON.parse(policy),target);break;case"6":var action=target.getAttribute("name");this.postAndEval(target.form,[action,""]);break;case"7":var action=target.getAttribute("name");var offset=target.getBoundingClientRect();var x=Math.round(event.clientX-offset.left);var y=Math.round(event.clientY-offset.top);this.postAndEval(target.form,[action+".x",x],[action+".y",y]);break;}
+event.preventDefault();return false;}}
+var nagare=new Nagare();
\ No newline at end of file
@@ -0,0 +1,193 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import json
+import zlib
+
+from webob import Request as WebRequest
+from webob import Response as WebResponse
+
+from nagare import action, component
+from nagare.services import callbacks
+
+
+class Request:
+    def __init__(self, **headers):
+        self.headers = headers
+
+
+class Html:
+    def __init__(self, html):
+        self.html = html
+
+    def tostring(self):
+        return self.html.encode('utf-8')
+
+
+def parse_parts(data):
+    parts = []
+
+    while data:
+        header, data = data.split(b'\n', 1)
+        command, length, *args = header.decode('ascii').split(' ')
+        payload, data = data[: int(length)], data[int(length) :]
+        parts.append((command, args, payload.decode('utf-8')))
+
+    return parts
+
+
+def test_parts():
+    assert not action.accept_parts(None)
+    assert not action.accept_parts(Request(Accept='text/plain'))
+    assert action.accept_parts(Request(Accept=action.PARTS_CONTENT_TYPE + ', text/plain'))
+
+    part1 = action.generate_part(True, 'replaceNode', 'root', payload='<p>é\n</p>')
+    part2 = action.generate_part(True, 'loadAll', payload='[]')
+    assert part1 == 'replaceNode 10 root\n<p>é\n</p>'.encode('utf-8')
+    assert parse_parts(action.join_parts(True, (part1, b'', part2))) == [
+        ('replaceNode', ['root'], '<p>é\n</p>'),
+        ('loadAll', [], '[]'),
+    ]
+
+    js = action.join_parts(False, (action.generate_part(False, 'replaceNode', 'root', payload='<p>"</p>'), b'', b'f()'))
+    assert js == b'nagare.replaceNode("root", "<p>\\"</p>"); f()'
+
+
+def test_affixes():
+    assert action.common_affixes('abcdef', 'abXYef') == (2, 2)
+    assert action.common_affixes('abc', 'abc') == (3, 0)
+    assert action.common_affixes('', 'abc') == (0, 0)
+    assert action.common_affixes('aXa', 'aa') == (1, 1)
+
+    assert action.utf16_len('abc') == 3
+    assert action.utf16_len('é€') == 2
+    assert action.utf16_len('\U0001f600') == 2
+
+
+def test_patch():
+    comp = component.Component()
+    old = '<div id="root"><ul><li>1</li><li>2</li><li>3</li></ul><p>\U0001f600</p></div>'
+    new = old.replace('<li>2</li>', '<li>two</li>')
+
+    assert parse_parts(action.Update.serialize_body(comp.render, 'root', Html(old), True)) == [
+        ('replaceNode', ['root'], old)
+    ]
+
+    (command, args, payload), *_ = parse_parts(action.Update.serialize_body(comp.render, 'root', Html(new), True))
+    assert command == 'patchNode'
+    assert payload == 'two'
+    crc, prefix, suffix = map(int, args[1:])
+    assert (args[0], crc) == ('root', zlib.crc32(old.encode('utf-8')))
+    assert (prefix, suffix) == (old.index('2'), action.utf16_len(old) - old.index('2') - 1)
+
+    # The full HTML is sent again when the client asks for it or for another DOM id
+    assert parse_parts(action.Update.serialize_body(comp.render, 'root', Html(old), True, False))[0][0] == 'replaceNode'
+    assert parse_parts(action.Update.serialize_body(comp.render, 'other', Html(new), True))[0][0] == 'replaceNode'
+
+    assert action.accept_patches(None)
+    assert action.accept_patches(Request())
+    assert not action.accept_patches(Request(**{action.REFRESH_HEADER: '1'}))
+
+
+class Tree(Html):
+    def __init__(self, id_, html, *ids):
+        super().__init__(html)
+        self.attrs = {'id': id_}
+        self.ids = ids
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def set(self, name, value):
+        self.attrs[name] = value
+
+    def xpath(self, path, id):
+        return [id] if id in self.ids else []
+
+
+class Head:
+    def assets(self):
+        return None
+
+
+class Response:
+    vary = ()
+
+
+class Renderer:
+    def __init__(self):
+        self.request = Request(Accept=action.PARTS_CONTENT_TYPE)
+        self.response = Response()
+        self.head = Head()
+
+
+def test_updates():
+    renderings = []
+
+    def render(renderer, view, items=()):
+        renderings.append(view)
+        return Tree(None, '<%s>' % view, *{'outer': ['inner']}.get(view, []))
+
+    def update(view, id_, **params):
+        return action.Partial(action.Update.generate_response_body, render, (view,), id_, tuple(params.items()))
+
+    renders = (update('inner', 'inner'), update('other', 'other'), update('other', 'other'), update('outer', 'outer'))
+    parts = parse_parts(action.Updates.generate_response(renders, Renderer()))
+
+    # The identical updates are rendered once and the nested updates are dropped
+    assert renderings == ['inner', 'other', 'outer']
+    assert parts == [('replaceNode', ['other'], '<other>'), ('replaceNode', ['outer'], '<outer>')]
+
+    # Without deduplication for the unhashable parameters
+    renderings.clear()
+    renders = (update('other', 'other', items=[1]), update('other', 'other', items=[1]))
+    action.Updates.generate_response(renders, Renderer())
+    assert renderings == ['other', 'other']
+
+
+def test_remote_results():
+    callbacks.CallbacksService('callbacks', None)
+
+    class Renderer:
+        def __init__(self, params):
+            self.request = WebRequest.blank('/?_params=' + params)
+            self.response = WebResponse()
+
+    def call(f, params='[]', batch_params=None):
+        remote = action.Repeat(f)
+        renderer = Renderer(params)
+        r = remote.generate_response(f, (), None, (), renderer, batch_params)
+
+        return r, renderer.response
+
+    r, response = call(lambda *args: list(args), '[1, 2]')
+    assert (r, response.status_int, response.content_type) == ('[1, 2]', 200, 'application/json')
+    assert 'X-Nagare-Interval' not in response.headers
+
+    r, response = call(lambda: action.NO_CHANGE)
+    assert (r, response.status_int) == ('', 204)
+
+    r, response = call(lambda: action.Interval({'a': 1}, 5000))
+    assert (r, response.headers['X-Nagare-Interval']) == ('{"a": 1}', '5000')
+
+    r, response = call(lambda: action.Interval(action.NO_CHANGE, 100))
+    assert (r, response.status_int, response.headers['X-Nagare-Interval']) == ('', 204, '100')
+
+    # Into a batch, the result is not serialized and "no change" is ``None``
+    assert call(lambda x: x * 2, batch_params=[21])[0] == 42
+    assert call(lambda: action.NO_CHANGE, batch_params=[])[0] is None
+
+
+def test_repeat_options():
+    options = json.loads(action.Repeat(None, max_interval=1000).javascript_options()[2:])
+    assert options == {'backoff': 2, 'min_backoff': 1000, 'max_interval': 1000, 'pause_hidden': True}
+
+    policy = action.Policy(coalesce=True, abort=True)
+    options = json.loads(action.Repeat(None, policy=policy).javascript_options()[2:])
+    assert options['policy'] == {'debounce': 0, 'coalesce': True, 'abort': True}
@@ -0,0 +1,76 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+from nagare.server import application
+from nagare.services.callbacks import encode_action
+
+
+def create_request(sequence=None):
+    return application.Request.blank('/', environ={'HTTP_X_NAGARE_SEQUENCE': sequence} if sequence else {})
+
+
+def test_superseded(monkeypatch):
+    application.Request.sequences.clear()
+
+    request1 = create_request('page-0:1')
+    request2 = create_request('page-1:1')
+    assert not request1.superseded and not request2.superseded
+
+    # A newer request of the same element supersedes the older ones, still waiting for the session
+    request3 = create_request('page-0:2')
+    assert request1.superseded
+    assert not request2.superseded and not request3.superseded
+
+    # Without sequence, or an invalid one, a request is never superseded
+    for sequence in (None, 'page-0', 'page-0:x', ':3'):
+        request = create_request(sequence)
+        assert request.sequence is None
+        assert not request.superseded
+
+    # An older request received late doesn't supersede the newer ones
+    create_request('page-1:0')
+    assert not request2.superseded
+
+    monkeypatch.setattr(application.Request, 'MAX_SEQUENCES', 2)
+    create_request('page-2:1')
+    assert list(application.Request.sequences) == ['page-0', 'page-2']  # The least recently updated is dropped
+
+
+def test_actions():
+    request = application.Request.blank('/?_s=1&_c=2&_action1500001234=&_action0200000012=on&radio=_action0200000003')
+
+    assert request.actions == [
+        ((2, 2, 12, None, None), ['on']),
+        ((2, 2, 3, None, None), ['_action0200000003']),
+        ((5, 0x15, 1234, None, None), ['']),
+    ]
+
+    # Parsed once per request, even through another request object on the same environment
+    assert request.actions is request.actions
+    assert application.Request(request.environ).actions is request.actions
+    assert application.Request(request.environ).params is request.params
+
+
+def test_piped_actions():
+    compact1, compact2 = encode_action(2, 12), encode_action(2, 13)
+    request = application.Request.blank(
+        '/',
+        POST={
+            '|_action0200000012|_action0200000013|': 'on',
+            'select': '|_action0200000003|_action0200000004|',
+            '|%s|%s|' % (compact1, compact2): 'off',
+            'text': '|not an action|',
+        },
+    )
+
+    assert request.POST.getall('_action0200000012') == ['on']
+    assert request.POST.getall('_action0200000013') == ['on']
+    assert request.POST.getall('select') == ['_action0200000003', '_action0200000004']
+    assert request.POST.getall(compact1) == request.POST.getall(compact2) == ['off']
+    assert request.POST.getall('text') == ['|not an action|']
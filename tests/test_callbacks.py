@@ -0,0 +1,108 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import json
+
+import pytest
+from webob import Response, exc
+
+from nagare import action
+from nagare.services import callbacks
+
+
+def test_encode_action():
+    for action_type in (callbacks.LINK_CALLBACK, callbacks.SUBMIT_CALLBACK | callbacks.WITH_CONTINUATION_CALLBACK):
+        for action_id in (0, 61, 62, 1234, 2**64 - 1):
+            action_name = callbacks.encode_action(action_type, action_id)
+
+            assert action_name.startswith('_-') and not action_name.startswith('_action')
+            assert callbacks.parse_action(action_name) == (action_type & 15, action_type, action_id, None, None)
+            assert callbacks.parse_action(action_name + '.y#abc') == (
+                action_type & 15,
+                action_type,
+                action_id,
+                '.y',
+                'abc',
+            )
+
+    assert callbacks.encode_action(callbacks.LINK_CALLBACK | callbacks.WITH_CONTINUATION_CALLBACK, 1234) == '_-DjU'
+
+
+def test_parse_action():
+    assert callbacks.parse_action('_action1500001234') == (5, 0x15, 1234, None, None)
+    assert callbacks.parse_action('_action0712.x') == (7, 7, 12, '.x', None)
+    assert callbacks.parse_action('_action0500000012#abc=') == (5, 5, 12, None, 'abc=')
+
+    for name in ('_action05', '_action2512', '_actionxx', '_-5', '_-b12', '_-5-12', '_s', '_c', '_batch'):
+        assert callbacks.parse_action(name) is None
+
+    # The usual field names are not callback identifiers
+    for name in ('_aDate', '_aBout', '_a5zz', '_about', '_-', 'a_-5zz'):
+        assert callbacks.parse_action(name) is None
+
+
+def test_parse_actions():
+    actions = callbacks.parse_actions(
+        [('_s', '42'), ('_c', '10'), ('group', '_-21'), ('_-1A', '_-5zz'), ('_-1A', 'x'), ('_-0B', '')]
+        + [('_aDate', '2026-10-17'), ('about', '_aBout'), ('text', '_-5zz')]
+    )
+
+    # Only the radio buttons have their callback identifier as value
+    assert actions == [
+        ((0, 0, 37, None, None), ['']),
+        ((1, 1, 36, None, None), ['_-5zz', 'x']),
+        ((2, 2, 1, None, None), ['_-21']),
+    ]
+
+
+def test_client_params():
+    service = callbacks.CallbacksService('callbacks', None)
+
+    assert service.encode_client_params({}) == ''
+    assert service.decode_client_params('') == {}
+
+    encoded = service.encode_client_params({'row': 42, 'label': 'é'})
+    assert service.encode_client_params({'row': 42, 'label': 'é'}) == encoded
+    assert service.decode_client_params(encoded) == {'row': 42, 'label': 'é'}
+    assert service.decode_client_params(encoded) is not service.decode_client_params(encoded)
+    assert service.encrypt.cache_info().hits == 1
+
+
+def test_handle_batch():
+    class Renderer:
+        request = None
+        response = Response()
+
+    service = callbacks.CallbacksService('callbacks', None)
+
+    remote = action.Remote(lambda a, b: a + b, 10)
+    update = action.Update(render=lambda h: None)
+    registered = {
+        1: (None, False, action.Partial(remote.generate_response, remote._render, (), None, ()), (), {}),
+        2: (None, False, action.Partial(update.generate_response, update._render, (), 'root', ()), (), {}),
+    }
+
+    name1 = callbacks.encode_action(callbacks.LINK_CALLBACK, 1)
+    render = service.handle_batch(registered, json.dumps([[name1, [1]], [name1, [2]]]))
+    assert render(Renderer) == '[11, 12]'
+
+    for batch in (
+        '[',
+        '{"a": 1}',
+        '[1]',
+        '[[null, []]]',
+        '[["_s", []]]',
+        json.dumps([[name1, {}]]),
+        json.dumps([[callbacks.encode_action(callbacks.LINK_CALLBACK, 2), []]]),
+    ):
+        with pytest.raises(exc.HTTPBadRequest):
+            service.handle_batch(registered, batch)
+
+    with pytest.raises(callbacks.CallbackLookupError):
+        service.handle_batch(registered, json.dumps([[callbacks.encode_action(callbacks.LINK_CALLBACK, 3), []]]))
@@ -7,9 +7,14 @@
 # this distribution.
 # --
 
+import time
+import pickle
+import asyncio
+import threading
+
 import pytest
 
-from nagare import var, component, presentation
+from nagare import var, state, component, fragments, presentation
 from nagare.renderers import xhtml
 
 
@@ -133,3 +138,440 @@ def test4():
 
     foo.becomes(view='foo')
     assert foo.render(h).tostring(pretty_print=False) == b"<h1>I'm bar in foo</h1>"
+
+
+# -------------------------------------------------------------------------------------------------------
+
+
+def test5():
+    """Component - asynchronous call."""
+    v = var.Var(42)
+    app = Foobar()
+
+    app.my_property.becomes(Foo(), 'foo')
+
+    async def action():
+        await asyncio.sleep(0)
+        v(await app.my_property.call(Bar(), 'bar'))
+
+    assert component.async_wrapper(action()) is None
+    assert isinstance(app.my_property(), Bar)
+    assert app.my_property.view == 'bar'
+
+    component.answer_wrapper(app.my_property, "I'm bar")
+
+    assert isinstance(app.my_property(), Foo)
+    assert app.my_property.view == 'foo'
+    assert v() == "I'm bar"
+
+    assert component.async_wrapper(action()) is None
+
+    # The suspended coroutine stays in memory, it can't be serialized
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(app)
+
+    cont = app.my_property._cont
+    component.answer_wrapper(app.my_property, 'first')
+    assert v() == 'first'
+
+    # Already resumed (i.e. double click)
+    assert cont.resume('second') is None
+    assert v() == 'first'
+    assert isinstance(app.my_property(), Foo)
+
+
+def test5_nested():
+    """Component - asynchronous call answered by an other coroutine."""
+    v = var.Var()
+    app = Foobar()
+
+    async def caller():
+        v(await app.my_property.call(Bar()))
+        await asyncio.sleep(0.01)
+        v(v() + ' done')
+
+    async def answerer():
+        component.answer_wrapper(app.my_property, "I'm bar")
+
+    assert component.async_wrapper(caller()) is None
+
+    # The request answering waits for the resumed coroutine too
+    component.async_wrapper(answerer())
+    assert v() == "I'm bar done"
+
+
+def test5_timeout():
+    """Component - asynchronous action cancelled after the timeout."""
+    v = var.Var(0)
+    cancelled = threading.Event()
+
+    async def action():
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                v(v() + 1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    assert component.async_wrapper(action(), timeout=0.01) is None
+    assert cancelled.is_set()
+
+    # The state is not changed after the request
+    n = v()
+    time.sleep(0.01)
+    assert v() == n
+
+
+# -------------------------------------------------------------------------------------------------------
+
+
+class Wizard(component.GeneratorTask):
+    pure = True
+
+    def go(self, comp):
+        name = yield Foo()
+        age = yield Bar()
+
+        return (name, age)
+
+
+class App2(Foo):
+    def __init__(self):
+        super().__init__()
+        self.wizard = component.Component(Wizard()).on_answer(self.set_my_property)
+
+
+def test6():
+    """Component - generator task."""
+    app = App2()
+    wizard = app.wizard()
+    wizard.comp = app.wizard
+    wizard.run()
+
+    assert isinstance(wizard.content(), Foo)
+    wizard.content.answer('John')
+    assert isinstance(wizard.content(), Bar)
+
+    app = pickle.loads(pickle.dumps(app))
+    wizard = app.wizard()
+    assert wizard.generator is None
+
+    wizard.content.answer(42)
+    assert isinstance(wizard.content(), Foo)
+    assert wizard.answers == []
+    assert app.my_property == ('John', 42)
+
+
+class ImpureWizard(Wizard):
+    pure = False
+
+
+class EmptyWizard(component.GeneratorTask):
+    def go(self, comp):
+        return 42
+        yield
+
+
+def test6_errors():
+    """Component - generator tasks not pure or yielding nothing."""
+    wizard = ImpureWizard()
+    wizard.run()
+    wizard.content.answer('John')
+
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(component.Component(wizard))
+
+    with pytest.raises(ValueError):
+        EmptyWizard().run()
+
+
+def test7():
+    """Component - stable actions ids."""
+    app = Foo()
+    comp = component.Component(app)
+
+    action_id = comp.register_action(app.set_my_property, False, None, (42,), {})
+    assert comp.register_action(app.set_my_property, False, None, (42,), {}) == action_id
+    assert comp.register_action(app.set_my_property, False, None, (43,), {}) != action_id
+    assert comp.register_action(app.set_my_property, False, None, ([],), {}) != comp.register_action(
+        app.set_my_property, False, None, ([],), {}
+    )
+
+    comp.serialize_actions(False)
+    comp = pickle.loads(pickle.dumps(comp))
+    assert comp.register_action(comp().set_my_property, False, None, (42,), {}) == action_id
+
+
+def test8():
+    """Component - actions tables kept when unchanged."""
+    app = Foo()
+    comp = component.Component(app)
+
+    assert comp.serialize_actions(False) == {}
+
+    comp.register_action(app.set_my_property, False, None, (42,), {})
+    actions = comp.serialize_actions(False)
+    assert comp.serialize_actions(False) is actions
+
+    comp.register_action(app.set_my_property, False, None, (42,), {})
+    assert comp.serialize_actions(False) is actions
+
+    comp.register_action(app.set_my_property, False, None, (43,), {})
+    assert comp.serialize_actions(False).keys() != actions.keys()
+    assert comp.serialize_actions(True) == {}
+
+
+class Row:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def test8_equal_arguments():
+    """Component - actions re-registered with equal but new arguments."""
+    app = Foo()
+    comp = component.Component(app)
+
+    comp.register_action(app.set_my_property, False, None, (Row(1, 'old'),), {})
+    actions = comp.serialize_actions(False)
+
+    action_id = comp.register_action(app.set_my_property, False, None, (Row(1, 'new'),), {})
+    new_actions = comp.serialize_actions(False)
+    assert new_actions.keys() == actions.keys()
+    assert new_actions is not actions
+
+    action, _, _, args, kw = new_actions[action_id]
+    action(*args, **kw)
+    assert app.my_property.value == 'new'
+
+
+def test9():
+    """Component - eviction of the old actions."""
+    app = Foo()
+    comp = component.Component(app)
+
+    for view in (Foo.set_my_property, Foo.__init__, Bar.__init__):
+        comp.register_action(view, False, None, (), {})
+        comp.serialize_actions(False)
+
+    comp.register_action(app.set_my_property, False, None, (), {})
+    evicted = {}
+    actions = comp.serialize_actions(False, 2, evicted)
+    assert [action[0] for action in actions.values()] == [app.set_my_property, Bar.__init__]
+    assert [action[0] for action in evicted.values()] == [Foo.__init__, Foo.set_my_property]
+
+
+class Counter(state.Tracked):
+    def __init__(self):
+        self.value = 0
+
+
+def test10():
+    """Component - changes tracking."""
+
+    class Result:
+        callbacks = {}
+        components = 0
+
+    comp = component.Component(Counter())
+    changes = []
+    comp.reduce(False, Result(), changes=changes)
+    assert changes == [comp]
+
+    changes = []
+    comp.reduce(False, Result(), changes=changes)
+    assert changes == []
+
+    comp().value += 1
+    comp.reduce(False, Result(), changes=changes)
+    assert changes == [comp]
+
+    changes = []
+    comp.becomes(Counter())
+    comp().value += 1
+    comp.reduce(False, Result(), changes=changes)
+    comp.reduce(False, Result(), changes=changes)
+    assert changes == [comp]
+
+    comp = component.Component(Foo())
+    changes = []
+    comp.reduce(False, Result(), changes=changes)
+    comp.reduce(False, Result(), changes=changes)
+    assert changes == [comp, comp]
+
+
+class CachedCounter(Counter, fragments.Cached):
+    pass
+
+
+class Menu(fragments.Cached):
+    def __init__(self):
+        self.nb_renderings = 0
+        self.item = component.Component(CachedCounter())
+        self.entries = []
+
+
+@presentation.render_for(Menu)
+def render_menu(self, h, comp, *args):
+    self.nb_renderings += 1
+    comp.register_action(self.__init__, False, None, (), {})
+
+    return 'menu' + str(self.item.render(h)) + ''.join(self.entries) + ' ?_s=1&_c=%d' % h.state_id
+
+
+@presentation.render_for(Counter)
+def render_counter(self, h, comp, *args):
+    return str(self.value)
+
+
+def test11():
+    """Component - fragments cache."""
+
+    class Renderer:
+        is_async = False
+
+    class Result:
+        callbacks = {}
+        components = 0
+
+    h = Renderer()
+    h.state_id = 3
+    menu = component.Component(Menu())
+    assert menu.render(h) == 'menu0 ?_s=1&_c=3'
+    menu.reduce(False, Result(), changes=[])
+    menu().item.reduce(False, Result(), changes=[])
+
+    h.state_id = 4  # New state snapshot
+    assert menu.render(h) == 'menu0 ?_s=1&_c=4'
+    assert menu().nb_renderings == 1
+    assert len(menu.serialize_actions(True)) == 1
+
+    menu().item().value = 42
+    assert menu.render(h) == 'menu42 ?_s=1&_c=4'
+    assert menu().nb_renderings == 2
+    menu.reduce(False, Result(), changes=[])
+    menu().item.reduce(False, Result(), changes=[])
+
+    menu().entries.append(' entry')  # In-place change, not seen
+    assert menu.render(h) == 'menu42 ?_s=1&_c=4'
+
+    state.touch(menu())
+    assert menu.render(h) == 'menu42 entry ?_s=1&_c=4'
+
+    counter = component.Component(Counter())  # Not ``Cached``
+    counter.render(h)
+    assert counter._fragments is None
+
+
+def test11_serialized():
+    """Component - fragments cache lost with the serialized states."""
+
+    class Renderer:
+        is_async = False
+        state_id = 3
+
+    h = Renderer()
+    menu = component.Component(Menu())
+    menu.render(h)
+    assert menu._fragments
+
+    # Only kept with the objects graph, lost after a state load
+    menu = pickle.loads(pickle.dumps(menu))
+    assert menu._fragments is None
+
+    nb_renderings = menu().nb_renderings
+    assert menu.render(h) == 'menu0 ?_s=1&_c=3'
+    assert menu().nb_renderings == nb_renderings + 1
+
+
+def test11_untracked(monkeypatch):
+    """Component - no fragments cache without the changes tracking."""
+
+    class Renderer:
+        is_async = False
+        state_id = 3
+
+    monkeypatch.setattr(fragments, 'changes_tracked', False)
+
+    menu = component.Component(Menu())
+    with pytest.warns(RuntimeWarning, match='track_changes'):
+        menu.render(Renderer())
+
+    assert menu._fragments is None
+
+
+class Footer:
+    nb_renderings = 0
+
+    def __init__(self, lang):
+        self.lang = lang
+
+
+@presentation.render_for(Footer)
+@fragments.pure(key=lambda self: self.lang)
+def render_footer(self, h, comp, *args):
+    Footer.nb_renderings += 1
+
+    if self.lang == 'actions':
+        comp.register_action(self.__init__, False, None, (), {})
+
+    return 'footer ' + self.lang
+
+
+def test12():
+    """Component - pure views."""
+
+    class Renderer:
+        is_async = False
+        session_id = 1234
+
+    h = Renderer()
+    fragments.pure_views.clear()
+
+    for lang in ('en', 'fr', 'en', 'actions', 'actions'):
+        assert component.Component(Footer(lang)).render(h) == 'footer ' + lang
+
+    assert Footer.nb_renderings == 4
+    assert fragments.pure_views.hits == 1
+    assert fragments.pure_views.misses == 4
+    assert len(fragments.pure_views.entries) == 2
+
+
+def test13():
+    """Component - HTML sent for an async root."""
+    comp = component.Component(Foo())
+
+    assert comp.last_html('root', '<div>1</div>') is None
+    assert comp.last_html('root', '<div>12</div>') == '<div>1</div>'
+    assert comp.last_html('other', '<div>3</div>') is None
+
+    # Only a digest is kept into the state snapshots
+    assert b'<div>3</div>' not in pickle.dumps(comp)
+
+    comp = pickle.loads(pickle.dumps(comp))
+    assert comp.last_html('other', '<div>34</div>') == '<div>3</div>'
+
+    component.Component.sent_html.clear()
+    assert comp.last_html('other', '<div>345</div>') is None
+
+
+def test13_size(monkeypatch):
+    """Component - HTML sent bounded by size."""
+    monkeypatch.setattr(component.Component, 'sent_html', fragments.LRUCache(max_size=100))
+    comp = component.Component(Foo())
+
+    comp.last_html('root', '<div>%s</div>' % ('x' * 40))
+    assert comp.last_html('root', '<div>%s</div>' % ('y' * 40)) == '<div>%s</div>' % ('x' * 40)
+    assert component.Component.sent_html.size == 51  # The first HTML evicted
+
+    # Too big to be kept
+    comp.last_html('root', '<div>%s</div>' % ('z' * 100))
+    assert comp.last_html('root', '<div>1</div>') is None
+    assert component.Component.sent_html.size == 12
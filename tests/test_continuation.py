@@ -6,8 +6,13 @@
 # the file LICENSE.txt, which you should have received as part of
 # this distribution.
 # --
+import gc
+import sys
+import types
 import pickle
 
+import pytest
+
 from nagare import continuation
 
 
@@ -44,3 +49,126 @@ def test_pickle():
     assert pickle.loads(pickle.dumps(cont)).resume(3) == 321
     assert pickle.loads(pickle.dumps(cont)).resume(4) == 421
     assert pickle.loads(pickle.dumps(cont)).resume(3) == 321
+
+
+@pytest.mark.parametrize('use_monitoring', [False, True] if continuation.MONITORING else [False])
+def test_engines(use_monitoring, monkeypatch):
+    """Continuation - ``sys.settrace()`` and ``sys.monitoring`` restore engines."""
+    monkeypatch.setattr(continuation.Continuation, 'use_monitoring', use_monitoring)
+
+    cont = continuation.delimit(h)
+    assert isinstance(cont, continuation.Continuation)
+
+    assert cont.resume(3) == 321
+    assert cont.resume(4) == 421
+    assert cont.tracing != use_monitoring
+    assert sys.gettrace() is None
+
+
+def k(n):
+    return 1 + (k(n - 1) if n else continuation.Continuation().suspend())
+
+
+@pytest.mark.skipif(not continuation.MONITORING, reason='sys.monitoring not available')
+def test_monitoring_recursion():
+    """Continuation - recursive frames with ``sys.monitoring``."""
+    cont = continuation.delimit(k, 10)
+    assert cont.resume(10) == 21
+    assert pickle.loads(pickle.dumps(cont)).resume(20) == 31
+
+
+@pytest.mark.skipif(not continuation.MONITORING, reason='sys.monitoring not available')
+def test_monitoring_without_tool_id(monkeypatch):
+    """Continuation - fallback to ``sys.settrace()`` when all the free tool ids are used."""
+    monkeypatch.setattr(continuation.Continuation, 'use_monitoring', True)
+    monkeypatch.setattr(continuation._Monitoring, 'tool_id', None)
+
+    used = [tool_id for tool_id in (3, 4, sys.monitoring.OPTIMIZER_ID) if sys.monitoring.get_tool(tool_id) is None]
+    for tool_id in used:
+        sys.monitoring.use_tool_id(tool_id, 'test')
+
+    try:
+        cont = continuation.delimit(h)
+
+        # Also after the first failed registration
+        for value in (3, 4):
+            assert cont.resume(value) == value * 100 + 21
+            assert cont.tracing
+    finally:
+        for tool_id in used:
+            sys.monitoring.free_tool_id(tool_id)
+
+    assert continuation._Monitoring.tool_id is False
+    assert sys.gettrace() is None
+
+
+def m(a):
+    big = list(range(10000))
+    b = len(big)
+
+    if a:
+        b += continuation.Continuation().suspend() + a
+    else:
+        b += big[-1]
+
+    return b
+
+
+def test_live_locals():
+    """Continuation - only the live locals are captured."""
+    cont = continuation.delimit(m, 1)
+
+    locals_ = cont.frames[0][2]
+    assert set(locals_) == {'a', 'b'}
+
+    assert cont.resume(1) == 10002
+    assert cont.resume(2) == 10003
+
+
+def test_unreachable_line():
+    """Continuation - unreachable lines are detected before the code is re-executed."""
+    cont = continuation.delimit(h)
+
+    f_hash, lineno, locals_ = cont.frames[0]
+    cont.frames[0] = (f_hash, lineno + 1000, locals_)
+
+    with pytest.raises(continuation.ContinuationUnreacheableLine):
+        cont.resume(3)
+
+    assert cont.current_frame == 0
+
+
+def p():
+    a = 1
+    # No instruction on this line
+    return g(10) + a
+
+
+def test_line_without_instruction():
+    """Continuation - a line without instruction is not a resume point."""
+    cont = continuation.delimit(p)
+
+    f_hash, lineno, locals_ = cont.frames[0]
+    cont.frames[0] = (f_hash, p.__code__.co_firstlineno + 2, locals_)
+
+    with pytest.raises(continuation.ContinuationUnreacheableLine):
+        cont.resume(3)
+
+    cont.frames[0] = (f_hash, lineno, locals_)
+    assert cont.resume(3) == 321
+
+
+def test_code_registry():
+    """Continuation - the registry doesn't keep the code objects alive."""
+    # New code object, of a function ``h`` at an other place
+    q = types.FunctionType(h.__code__.replace(co_firstlineno=100000), globals())
+
+    cont = continuation.delimit(q)
+    code_id = id(q.__code__)
+    f_hash = cont.frames[0][0]
+    assert (code_id in continuation._codes) and (f_hash in continuation._hashes)
+    assert cont.resume(3) == 321
+
+    del q, cont
+    gc.collect()
+    assert (code_id not in continuation._codes) and (f_hash not in continuation._hashes)
@@ -12,7 +12,8 @@ from io import BytesIO as BuffIO
 
 from lxml import etree
 
-from nagare import component, presentation
+from nagare import action, component, presentation
+from nagare.services import callbacks
 from nagare.renderers import html
 
 
@@ -560,7 +561,7 @@ def test_a():
         '',
         '/foo/a',
         '',
-        {'_s': ['42'], '_c': ['00010'], '_action1500001234': ['']},
+        {'_s': ['42'], '_c': ['10'], '_-DjU': ['']},
     )
 
     a = h.a('action', href='/foo/a#b').action(lambda: None)
@@ -570,7 +571,7 @@ def test_a():
         '',
         '/foo/a',
         'b',
-        {'_s': ['42'], '_c': ['00010'], '_action1500001234': ['']},
+        {'_s': ['42'], '_c': ['10'], '_-DjU': ['']},
     )
 
 
@@ -645,4 +646,33 @@ def test_button():
 
     h = html.Renderer(session_id=42, state_id=10, component=Component())
 
-    assert h.button.action(lambda: None).tostring() == b'<button name="_action1600001234"></button>'
+    assert h.button.action(lambda: None).tostring() == b'<button name="_-EjU"></button>'
+
+
+def test_shared_action():
+    selected = []
+
+    def select(column, row, page):
+        selected.append((column, row, page))
+
+    service = callbacks.CallbacksService('callbacks', None)
+    comp = component.Component()
+    h = html.Renderer(session_id=42, state_id=10, component=comp)
+
+    shared = action.Shared(select, 'title')
+    links = [h.a(str(row), href='/grid').action(shared, row, page_c=row // 10) for row in range(100)]
+
+    actions = comp.serialize_actions(False)
+    assert len(actions) == 1
+
+    ((action_id, (f, with_request, render, args, kw)),) = actions.items()
+    for link in links:
+        params = urlparse.parse_qs(urlparse.urlparse(link.get('href')).query, keep_blank_values=True)
+        ((name, (value,)),) = [(name, value) for name, value in params.items() if name not in ('_s', '_c')]
+
+        assert callbacks.parse_action(name)[2] == action_id
+        f(*args, **(service.decode_client_params(value) | kw))
+
+    assert selected == [('title', row, row // 10) for row in range(100)]
+
+    callbacks.callbacks_service = None
@@ -0,0 +1,104 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import threading
+
+import pytest
+from webob import Request, exc
+
+from nagare.services import push
+
+
+class Chain:
+    def next(self, **params):
+        return 'next'
+
+
+def test_broker():
+    broker = push.Broker()
+    q1 = broker.subscribe('42')
+    q2 = broker.subscribe('42')
+
+    assert broker.publish('42', None, 'f()') == 2
+    assert broker.publish('10', None, 'f()') == 0
+    assert q1.get_nowait() == q2.get_nowait() == (None, 'f()')
+
+    broker.unsubscribe('42', q1)
+    broker.unsubscribe('42', q2)
+    assert not broker.channels
+
+
+def test_stream():
+    service = push.PushService('push', None, keepalive=0.01, retry=1000)
+    stream = service.stream('42')
+    assert service.nb_streams == 1
+
+    assert next(stream) == b'retry: 1000\n\n'
+    assert next(stream) == b': keepalive\n\n'
+
+    assert service.publish('42', 'f()\ng()') == 1
+    assert next(stream) == b'data: f()\ndata: g()\n\n'
+    assert service.publish('42', {'value': 'é'}, 'counter') == 1
+    assert next(stream) == 'event: counter\ndata: {"value": "\\u00e9"}\n\n'.encode('utf-8')
+
+    stream.close()
+    assert service.nb_streams == 0
+    assert service.publish('42', 'f()') == 0
+
+
+def test_handle_request():
+    service = push.PushService('push', None, keepalive=30, retry=3000, max_streams=1)
+
+    def handle_request(session_id, signature):
+        request = Request.blank('/?_s=%s&_push=%s' % (session_id, signature))
+        return service.handle_request(Chain(), request=request, response=None)
+
+    assert service.handle_request(Chain(), request=Request.blank('/?_s=42'), response=None) == 'next'
+
+    # The session id alone is not enough to open the stream
+    with pytest.raises(exc.HTTPForbidden):
+        handle_request('42', '')
+    with pytest.raises(exc.HTTPForbidden):
+        handle_request('42', service.sign('43'))
+    with pytest.raises(exc.HTTPForbidden):
+        handle_request('42', '%C3%A9')
+
+    response = handle_request('42', service.sign('42'))
+    assert response.content_type == 'text/event-stream'
+    next(response.app_iter)
+
+    with pytest.raises(exc.HTTPServiceUnavailable):
+        handle_request('43', service.sign('43'))
+
+    response.app_iter.close()
+    assert handle_request('43', service.sign('43')).content_type == 'text/event-stream'
+
+
+def test_max_streams():
+    service = push.PushService('push', None, keepalive=30, retry=3000, max_streams=2)
+    barrier = threading.Barrier(10)
+    streams = []
+
+    def open_stream():
+        barrier.wait()
+        streams.append(service.stream('42'))
+
+    threads = [threading.Thread(target=open_stream) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    opened = [stream for stream in streams if stream is not None]
+    assert (len(opened), service.nb_streams) == (2, 2)
+
+    # The slots are released even if the streams were never iterated
+    for stream in opened:
+        stream.close()
+    assert service.nb_streams == 0
@@ -0,0 +1,98 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import io
+import pickle
+import copyreg
+
+from nagare import state, component, fragments
+from nagare.services.state import StateService
+
+
+class SessionService:
+    def set_persistent_id(self, persistent_id):
+        pass
+
+    def set_dispatch_table(self, dispatch_table):
+        self.dispatch_table = dispatch_table
+
+
+class Result:
+    def __init__(self):
+        self.callbacks = {}
+        self.components = 0
+
+
+class Counter(state.Tracked):
+    def __init__(self):
+        self.value = 0
+
+
+class Untracked:
+    def __init__(self):
+        self.values = []
+
+
+class Root(state.Tracked):
+    def __init__(self):
+        self.counter1 = component.Component(Counter())
+        self.counter2 = component.Component(Counter())
+        self.untracked = component.Component(Untracked())
+
+
+def create_service(monkeypatch, **config):
+    monkeypatch.setattr(fragments, 'changes_tracked', None)
+    config = {'send_response': True, 'max_actions': 0, 'track_changes': True} | config
+
+    return StateService(
+        'state', None, services_service=lambda f, *args, **kw: None, session_service=SessionService(), **config
+    )
+
+
+def dump(service, o):
+    """Serialize a state as the sessions store does."""
+    result = Result()
+
+    f = io.BytesIO()
+    pickler = pickle.Pickler(f)
+    pickler.dispatch_table = copyreg.dispatch_table | service.set_dispatch_table(False, result)
+    pickler.dump(o)
+
+    return result
+
+
+def test_changed_components(monkeypatch):
+    service = create_service(monkeypatch)
+    root = component.Component(Root())
+
+    # First snapshot: all the components are new
+    result = dump(service, root)
+    assert len(service.changed_components(result)) == result.components == 4
+
+    r = root()
+    r.counter2().value += 1
+    result = dump(service, root)
+    assert result.changes == [r.counter2]
+    assert result.untracked == [r.untracked]
+    assert service.changed_components(result) == [r.counter2, r.untracked]
+
+    r.counter1.becomes(Counter())
+    result = dump(service, root)
+    assert result.changes == [r.counter1]
+
+    result = dump(service, root)
+    assert result.changes == []
+
+
+def test_changes_not_tracked(monkeypatch):
+    service = create_service(monkeypatch, track_changes=False)
+    assert fragments.changes_tracked is False
+
+    result = dump(service, component.Component(Root()))
+    assert service.changed_components(result) is None
@@ -0,0 +1,146 @@
+# --
+# Copyright (c) 2014-2026 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+# --
+
+import json
+
+from webob import Request, Response, exc
+
+from nagare.services import websocket
+
+
+class Chain:
+    def next(self, request, response, start_response, **params):
+        if request.params.get('fail'):
+            raise ValueError()
+
+        if request.params.get('forbidden'):
+            raise exc.HTTPForbidden()
+
+        body = json.dumps(
+            {
+                'method': request.method,
+                'params': dict(request.params),
+                'xhr': request.is_xhr,
+                'sequence': request.headers.get('X-Nagare-Sequence'),
+                'cookie': request.headers.get('Cookie'),
+            }
+        )
+
+        if request.params.get('redirect'):
+            return Response(status=503, location='/expired')
+
+        start_response(
+            '200 OK',
+            [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body))),
+                ('Retry-After', '10'),
+                ('X-Nagare-Interval', '5000'),
+                ('Set-Cookie', 'a=b; Path=/'),
+                ('Set-Cookie', 'session=2; Path=/; HttpOnly'),
+            ],
+        )
+        return lambda environ, start_response: [body.encode('utf-8')]
+
+
+class WebSocket:
+    def __init__(self, *messages):
+        self.messages = [json.dumps(message) for message in messages]
+        self.sent = []
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_create_environ():
+    request = Request.blank('/app?_s=42&_ws', headers={'Cookie': 'session=1'})
+    request.params  # The parsed parameters of the connection request are cached into the environ
+
+    environ = websocket.WebSocketService.create_environ(
+        request.environ,
+        {
+            'url': 'http://localhost/app?_s=42&_c=10',
+            'method': 'POST',
+            'body': 'a=%C3%A9',
+            'headers': {'X-Nagare-Sequence': 'p-1:2', 'Authorization': 'x'},
+        },
+    )
+    request = Request(environ, charset='utf-8')
+
+    assert dict(request.params) == {'_s': '42', '_c': '10', 'a': 'é'}
+    assert request.method == 'POST'
+    assert request.is_xhr
+    assert request.headers['Cookie'] == 'session=1'
+    assert request.headers['X-Nagare-Sequence'] == 'p-1:2'
+    assert 'Authorization' not in request.headers
+
+
+def test_handle_request():
+    service = websocket.WebSocketService('websocket', None)
+    ws = WebSocket(
+        {'id': 1, 'url': 'http://localhost/?_s=42&a=1', 'method': 'GET'},
+        {'id': 2, 'url': 'http://localhost/?redirect=1'},
+        {'id': 3, 'url': 'http://localhost/?fail=1'},
+        {'id': 4, 'url': 'http://localhost/?forbidden=1'},
+    )
+
+    request = Request.blank('/?_s=42&_ws', environ={'wsgi.websocket': ws}, headers={'Cookie': 'session=1'})
+    response = service.handle_request(Chain(), request=request, response=Response())
+    assert response.status_int == 200
+
+    r1, r2, r3, r4 = ws.sent
+
+    assert (r1['id'], r1['status']) == (1, 200)
+    assert r1['headers'] == {'content-type': 'application/json', 'retry-after': '10', 'x-nagare-interval': '5000'}
+    assert r1['cookies'] == ['a=b; Path=/']
+    body = json.loads(r1['body'])
+    assert body['params'] == {'_s': '42', 'a': '1'}
+    assert body['xhr'] and (body['cookie'] == 'session=1')
+
+    assert (r2['id'], r2['status'], r2['headers']['location']) == (2, 503, 'http://localhost/expired')
+    assert (r3['id'], r3['status']) == (3, 500)
+    assert (r4['id'], r4['status']) == (4, 403)
+
+    # Without WebSocket, the request goes on as an HTTP request
+    request = Request.blank('/?_s=42&a=1')
+    r = service.handle_request(Chain(), request=request, response=Response(), start_response=lambda *args: None)
+    assert json.loads(b''.join(r(None, None)))['params'] == {'_s': '42', 'a': '1'}
+
+
+class ExceptionsService:
+    def handle_exception(self, exception, request, **context):
+        return exc.HTTPOk() if request.is_xhr and isinstance(exception, ValueError) else exception
+
+
+def test_exceptions_service():
+    service = websocket.WebSocketService('websocket', None, exceptions_service=ExceptionsService())
+    ws = WebSocket({'id': 1, 'url': 'http://localhost/?fail=1'}, {'id': 2, 'url': 'http://localhost/?forbidden=1'})
+
+    request = Request.blank('/?_s=42&_ws', environ={'wsgi.websocket': ws})
+    service.handle_request(Chain(), request=request, response=Response())
+
+    assert [(r['id'], r['status']) for r in ws.sent] == [(1, 200), (2, 403)]
+
+
+def test_origin():
+    assert websocket.same_origin('http://localhost', 'localhost:80', 'http')
+    assert websocket.same_origin('https://example.com:8443', 'example.com:8443', 'https')
+    assert not websocket.same_origin('https://example.com', 'example.com', 'http')
+    assert not websocket.same_origin('http://evil.com', 'localhost', 'http')
+    assert not websocket.same_origin('null', 'localhost', 'http')
+
+    service = websocket.WebSocketService('websocket', None)
+    ws = WebSocket({'id': 1, 'url': 'http://localhost/'})
+
+    request = Request.blank('/?_s=42&_ws', environ={'wsgi.websocket': ws}, headers={'Origin': 'http://evil.com'})
+    assert service.handle_request(Chain(), request=request, response=Response()).status_int == 403
+    assert not ws.sent